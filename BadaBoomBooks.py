@@ -2,46 +2,22 @@ __version__ = 0.40
 
 from pathlib import Path
 import argparse
-import base64
-import configparser
 import logging as log
-import re
-import shutil
 import sys
-import time
-import webbrowser
 
 root_path = Path(sys.argv[0]).resolve().parent
 sys.path.append(str(root_path))
-from scrapers import http_request, api_audible, scrape_goodreads_type1, scrape_goodreads_type2
-from optional import create_opf, create_info, flatten_folder, rename_tracks
-
-from bs4 import BeautifulSoup
-from tinytag import TinyTag
-import pyperclip
+from organizer import Organizer, defaults, default_output
+from watchfolder import FolderWatcher
+from discover import LibraryScan
+from profiler import profiler
 
 # --- Define globals ---
-config_file = root_path / 'queue.ini'
 debug_file = root_path / 'debug.log'
-opf_template = root_path / 'template.opf'
-default_output = '_BadaBoomBooks_'  # In the same directory as the input folder
-
-# --- Logging configuration ---
-log.basicConfig(level=log.DEBUG, filename=str(debug_file), filemode='w', style='{', format="Line: {lineno} | Level: {levelname} |  Time: {asctime} | Info: {message}")
-
-# --- Configuring queue.ini ---
-config = configparser.ConfigParser()
-config.optionxform = lambda option: option
-config['urls'] = {}
-log.debug(config_file)
-
-# --- Book processing results ---
-failed_books = []
-skipped_books = []
-success_books = []
-
+mirror_file = root_path / 'mirror.sqlite'
+watch_file = root_path / 'watch.jsonl'
 
-print(fr"""
+banner = fr"""
 
 =========================================================================================
 
@@ -55,7 +31,7 @@ print(fr"""
                             An audioBook organizer (v{__version__})
 
 =========================================================================================
-""")
+"""
 
 parser = argparse.ArgumentParser(prog='python BadaBoomBooks.py', formatter_class=argparse.RawTextHelpFormatter, description='Organize audiobook folders through webscraping metadata', epilog=r"""
 Cheers to the community for providing our content and building our tools!
@@ -72,324 +48,209 @@ Cheers to the community for providing our content and building our tools!
 """)
 
 # ===== Prepare vaild arguments =====
+parser.add_argument('--import-metadata', metavar='FILE', help="Load a JSONL dump of Audible product records into the local metadata mirror, then exit")
+parser.add_argument('--input', metavar='SOURCE', default=defaults['input'], help="Also accept urls pasted into the terminal ('stdin') or written to a named pipe (path), one per line")
 parser.add_argument('-O', dest='output', metavar='OUTPUT', help='Path to place organized folders')
+parser.add_argument('-a', '--auto', action='store_true', help="Match books through an Audible search of their tags, only asking for a url when unsure")
+parser.add_argument('--auto-threshold', metavar='SCORE', type=float, default=defaults['auto_threshold'], help="Confidence (0-1) needed to accept an --auto match (default: 0.85)")
+parser.add_argument('--abs-json', action='store_true', help="Generate Audiobookshelf 'metadata.json' file")
+parser.add_argument('--analyze', action='store_true', help="Read the runtime, bitrate and track count of every book into its 'metadata.opf'/'badaboombooks.json' files, needs -o or -j")
+parser.add_argument('--analyze-workers', metavar='N', type=int, default=defaults['analyze_workers'], help="Number of processes reading audio files for --analyze (default: CPU count)")
+parser.add_argument('-b', '--book-workers', metavar='N', type=int, default=defaults['book_workers'], help="Number of books to move/copy/rename at once after scraping, 1 to process them one by one (default: 4)")
 parser.add_argument('-c', '--copy', action='store_true', help='Copy folders instead of renaming them')
+parser.add_argument('--link', metavar='MODE', choices=['hard', 'reflink', 'auto'], help="Build the output with hardlinks or reflinks instead of copying, originals are untouched [hard, reflink, auto]")
+parser.add_argument('--link-fallback', metavar='MODE', choices=['copy'], help="Copy files that can't be linked on a filesystem without hardlink/reflink support, instead of failing the book [copy]")
+parser.add_argument('--lookahead', metavar='N', type=int, default=defaults['lookahead'], help="Number of upcoming books whose tags and searches are prepared while you pick a url (default: 4)")
+parser.add_argument('--lookahead-tabs', action='store_true', help="Open the --lookahead books' search pages in background tabs ahead of time")
+parser.add_argument('--lookahead-matches', action='store_true', help="Run an Audible search for the --lookahead books and list the results, copy a number to pick one")
+parser.add_argument('--copy-workers', metavar='N', type=int, default=defaults['copy_workers'], help="Number of files to copy at once when copying a folder (default: 4)")
+parser.add_argument('--device-limit', metavar='N', type=int, default=defaults['device_limit'], help="Max books reading from or writing to the same disk at once (default: 2)")
 parser.add_argument('-d', '--debug', action='store_true', help='Enable debugging to log file')
+parser.add_argument('--dry-run', action='store_true', help="Only list where each book and its tracks would go, nothing is moved or written")
 parser.add_argument('-f', '--flatten', action='store_true', help="Flatten book folders, useful if the player has issues with multi-folder books")
 parser.add_argument('-i', '--infotxt', action='store_true', help="Generate 'info.txt' file, used by SmartAudioBookPlayer to display book summary")
+parser.add_argument('-j', '--json', action='store_true', help="Generate 'badaboombooks.json' file with all of the scraped metadata")
 parser.add_argument('-o', '--opf', action='store_true', help="Generate 'metadata.opf' file, used by Audiobookshelf to import metadata")
 parser.add_argument('-r', '--rename', action='store_true', help="Rename audio tracks to '## - {title}' format")
-parser.add_argument('-s', '--site', metavar='',  default='both', choices=['audible', 'goodreads', 'both'], help="Specify the site to perform initial searches [audible, goodreads, both]")
+parser.add_argument('--resume', action='store_true', help="Continue the previous queue, skipping books and steps that already finished")
+parser.add_argument('--profile', action='store_true', help="Time every stage of every book, written as a Chrome trace to --profile-output")
+parser.add_argument('--profile-output', metavar='FILE', help="File the --profile trace is written to, implies --profile (default: profile.json)")
+parser.add_argument('--refresh', action='store_true', help="Ignore cached metadata and request every book again")
+parser.add_argument('--scan', metavar='ROOT', help="Organize every book folder found under ROOT (folders with audio files, disc subfolders count as their parent)")
+parser.add_argument('--scan-workers', metavar='N', type=int, default=8, help="Number of folders to read at once while scanning (default: 8)")
+parser.add_argument('-s', '--site', metavar='',  default=defaults['site'], choices=['audible', 'goodreads', 'both'], help="Specify the site to perform initial searches [audible, goodreads, both]")
+parser.add_argument('--watch', metavar='DIR', help="Keep running and organize every new book folder that appears in DIR")
+parser.add_argument('--watch-quiet', metavar='SECONDS', type=float, default=60, help="How long a --watch folder must go without changes before it is processed (default: 60)")
+parser.add_argument('-w', '--workers', metavar='N', type=int, default=defaults['workers'], help="Number of books to fetch metadata for concurrently (default: 4)")
+parser.add_argument('--rate', metavar='N', type=float, default=defaults['rate'], help="Max requests per second to each host, 0 for no limit (default: 1 for goodreads, 5 for audible)")
+parser.add_argument('--retries', metavar='N', type=int, default=defaults['retries'], help="Times a book is retried after a temporary error (timeouts, 429/5xx), later in the queue (default: 5)")
+parser.add_argument('--connections', metavar='N', type=int, default=defaults['connections'], help="Max open connections to each host (default: 4)")
+parser.add_argument('--timeout', metavar='SECONDS', type=float, default=defaults['timeout'], help="Seconds to wait for a connection or an answer before a request is retried (default: 10 to connect, 30 to answer)")
 parser.add_argument('-v', '--version', action='version', version=f"Version {__version__}")
-parser.add_argument('folders', metavar='folder', nargs='+', help='Audiobook folder(s) to be organized')
+parser.add_argument('folders', metavar='folder', nargs='*', help='Audiobook folder(s) to be organized')
 
-args = parser.parse_args()
 
-if args.output:
-    test_output = Path(args.output).resolve()
-    if not test_output.is_dir():
-        log.debug(f"Output is not a directory/exists: {test_output}")
-        print(f"\nThe output path is not a directory or does not exist: {test_output}")
-        input("\nPress enter to exit...")
-        sys.exit()
+def print_summary(results):
+    # ----- Books organized by one batch, returns True if any failed -----
 
+    failed_books = [result['summary'] for result in results if result['status'] == 'failed']
+    skipped_books = [result['summary'] for result in results if result['status'] == 'skipped']
+    success_books = [result['summary'] for result in results if result['status'] == 'success']
+    if failed_books:
+        log.critical(f"Failed metadata scrapes: {','.join(failed_books)}")
+        print('\n\n====================================== FAILURES ======================================')
+        for failure in failed_books:
+            print(f"\nFailed: {failure}", end='')
+        print()
+        if skipped_books:
+            print('\n\n====================================== SKIPPED ======================================')
+            for skipped in skipped_books:
+                print(f"\nSkipped: {skipped}", end='')
+            print()
+        if success_books:
+            print('\n\n====================================== SUCCESS ======================================')
+            for book in success_books:
+                print(f"\nSuccess: {book}", end='')
+        print('\n\n====================================== WARNING ======================================')
+        print('\nSome books did not get processed successfully...\n')
+        return True
+    else:
+        log.info('Completed without errors')
+        if skipped_books:
+            print('\n\n====================================== SKIPPED ======================================')
+            for skipped in skipped_books:
+                print(f"\nSkipped: {skipped}", end='')
+            print()
+        print('\n\n====================================== SUCCESS ======================================')
+        for book in success_books:
+            print(f"\nSuccess: {book}", end='')
+        print('\n\n====================================== COMPLETE ======================================')
+        print('\nCheers to the community providing our content and building our tools!\n')
+        return False
 
-if not args.debug:
-    # --- Logging disabled ---
-    log.disable(log.CRITICAL)
 
+def main():
+    # ----- Command line, kept out of module scope so worker processes can import this file ([--analyze]) -----
 
-def clipboard_queue(folder, config):
-    # ----- Search for audibooks then monitor clipboard for URL -----
+    # --- Logging configuration ---
+    log.basicConfig(level=log.DEBUG, filename=str(debug_file), filemode='w', style='{', format="Line: {lineno} | Level: {levelname} |  Time: {asctime} | Info: {message}")
 
-    book_path = folder.resolve()
-    # - Try for search terms from id3 tags
+    print(banner)
 
-    title = False
-    author = False
+    args = parser.parse_args()
 
-    for file in book_path.glob('**/*'):
-        if file.suffix in ['.mp3', '.m4a', '.m4b', '.wma', '.flac']:
-            log.debug(f"TinyTag audio file: {file}")
-            track = TinyTag.get(str(file))
-            try:
-                title = re.sub(r"\&", 'and', track.album).strip()
-                if title == '':
-                    title = False
-                author = re.sub(r"\&", 'and', track.artist).strip()
-                if author == '':
-                    author = False
-                break
-            except Exception as e:
-                log.debug(f"Couldn't get search term metadata from ID3 tags, using foldername ({file}) | {e}")
+    if not args.folders and not (args.resume or args.import_metadata or args.watch or args.scan):
+        parser.error('the following arguments are required: folder')
 
-    if title and author:
-        search_term = f"{title} by {author}"
-    elif title:
-        search_term = title
-    else:
-        search_term = str(book_path.name)
-
-    # - Prompt user to copy AudioBook url
-    log.info(f"Search term: {search_term}")
-    if args.site == 'audible':
-        webbrowser.open(f"https://duckduckgo.com/?t=ffab&q=site:audible.com {search_term}", new=2)
-    elif args.site == 'goodreads':
-        webbrowser.open(f"https://duckduckgo.com/?t=ffab&q=site:goodreads.com {search_term}", new=2)
-    elif args.site == 'both':
-        webbrowser.open(f"https://duckduckgo.com/?t=ffab&q=audible.com goodreads.com {search_term}", new=2)
-
-    clipboard_old = pyperclip.paste()
-    log.debug(f"clipboard_old: {clipboard_old}")
-
-    if (re.search(r"http.+goodreads.+book/show/\d+", clipboard_old)) or (re.search(r"http.+audible.+/pd/[\w-]+Audiobook/\w+\??", clipboard_old)) or (re.search(r"skip", clipboard_old)):  # Remove old script contents from clipboard
-        clipboard_old = '__clipboard_cleared__'
-        pyperclip.copy(clipboard_old)
-
-    # - Wait for  url to be coppied
-    print(f"\nCopy the Audible or Goodreads URL for \"{book_path.name}\"\nCopy 'skip' to skip the current book...           ", end='')
-    while True:
-        time.sleep(1)
-        clipboard_current = pyperclip.paste()
-
-        if clipboard_current == clipboard_old:  # Clipboard contents have not yet changed
-            continue
-        elif clipboard_current == 'skip':  # user coppied 'skip' to clipboard
-            log.info(f"Skipping: {book_path.name}")
-            print(f"\n\nSkipping: {book_path.name}")
-            skipped_books.append(book_path.name)
-            break
-        elif re.search(r"^http.+audible.+/pd/[\w-]+Audiobook/\w{10}", clipboard_current):
-            # --- A valid Audible URL ---
-            log.debug(f"Clipboard Audible match: {clipboard_current}")
-
-            audible_url = re.search(r"^http.+audible.+/pd/[\w-]+Audiobook/\w{10}", clipboard_current)[0]
-            b64_folder = base64.standard_b64encode(bytes(str(book_path.resolve()), 'utf-8')).decode()
-            b64_url = base64.standard_b64encode(bytes(audible_url, 'utf-8')).decode()
-
-            log.debug(f"b64_folder: {b64_folder}")
-            log.debug(f"b64_url: {b64_url}")
-
-            config['urls'][b64_folder] = b64_url
-            print(f"\n\nAudible URL: {audible_url}")
-            break
-        elif re.search(r"^http.+goodreads.+book/show/\d+", clipboard_current):
-            # --- A valid Goodreads URL
-            log.debug(f"Clipboard GoodReads match: {clipboard_current}")
-
-            goodreads_url = re.search(r"^http.+goodreads.+book/show/\d+", clipboard_current)[0]
-            b64_folder = base64.standard_b64encode(bytes(str(book_path.resolve()), 'utf-8')).decode()
-            b64_url = base64.standard_b64encode(bytes(goodreads_url, 'utf-8')).decode()
-
-            log.debug(f"b64_folder: {b64_folder}")
-            log.debug(f"b64_url: {b64_url}")
-
-            config['urls'][b64_folder] = b64_url
-            print(f"\n\nGoodreads URL: {goodreads_url}")
-            break
-        else:
-            continue
-
-    pyperclip.copy(clipboard_old)
-    return config
-
-
-# ==========================================================================================================
-# ==========================================================================================================
-
-# ===== Create Path() objects for each argument folder =====
-folders = [Path(argument).resolve() for argument in args.folders]
-
-for folder in folders:
-    # --- Verify integrity of input folders ---
-    exists = folder.is_dir()
-    if not exists:
-        print(f"The input folder '{folder.name}' does not exist or is not a directory...")
-        input('Press enter to exit...')
+    if args.output:
+        test_output = Path(args.output).resolve()
+        if not test_output.is_dir():
+            log.debug(f"Output is not a directory/exists: {test_output}")
+            print(f"\nThe output path is not a directory or does not exist: {test_output}")
+            input("\nPress enter to exit...")
+            sys.exit()
+
+    if args.scan and args.folders:
+        parser.error("--scan finds the folders itself, folder arguments can't be combined with it")
+
+    if args.analyze and not (args.opf or args.json):
+        parser.error("--analyze fills the 'metadata.opf'/'badaboombooks.json' files, it needs -o or -j")
+
+    if args.scan and not Path(args.scan).is_dir():
+        print(f"\nThe scan path is not a directory or does not exist: {Path(args.scan).resolve()}")
         sys.exit()
 
-log.debug(folders)
-
-
-# ===== Build the queue using the .ini =====
-for folder in folders:
-    folder = folder.resolve()
-    config = clipboard_queue(folder, config)
-    print('\n-------------------------------------------')
-
-print('\n===================================== PROCESSING ====================================')
-
-with config_file.open('w', encoding='utf-8') as file:
-    config.write(file)
-
-
-# ===== Process all keys (folders) in .ini file =====
-config.read(config_file, encoding='utf-8')
-for key, value in config.items('urls'):
-    log.debug(f"Key: '{key}' ({type(key)}) - Value: '{value}' ({type(value)}")
-    try:
-        folder = base64.standard_b64decode(bytes(key, 'utf-8')).decode()
-        url = base64.standard_b64decode(bytes(value, 'utf-8')).decode()
-        log.debug(f"Folder: {folder} - URL: {url}")
-    except Exception as exc:
-        log.debug(f"Exception: {exc}")
-        continue
-
-    # ----- Scrape metadata -----
-    folder = Path(folder).resolve()
-
-    metadata = {
-        'author': '',
-        'authors_multi': '',
-        'title': '',
-        'summary': '',
-        'subtitle': '',
-        'narrator': '',
-        'publisher': '',
-        'publishyear': '',
-        'genres': '',
-        'isbn': '',
-        'asin': '',
-        'series': '',
-        'sereis_multi': '',
-        'volumenumber': '',
-        'url': url,
-        'skip': False,
-        'failed': False,
-        'failed_exception': '',
-        'input_folder': str(folder.resolve().name)
-    }
-
-    print(f"\n----- {metadata['input_folder']} -----")
-
-    # --- Request Metadata ---
-    while True:
-
-        if 'audible.com' in metadata['url']:
-            # --- ASIN ---
-            metadata['asin'] = re.search(r"^http.+audible.+/pd/[\w-]+Audiobook/(\w{10})", metadata['url'])[1]
-            query = {'response_groups': 'contributors,product_desc,series,product_extended_attrs,media'}
-            metadata, response = http_request(metadata, log, f"https://api.audible.com/1.0/catalog/products/{metadata['asin']}", query)
-            if metadata['skip'] is True:
-                break
-            page = response.json()['product']
-            metadata = api_audible(metadata, page, log)
-            break
-
-        elif 'goodreads.com' in metadata['url']:
-            metadata, response = http_request(metadata, log)
-
-            if args.debug:
-                with Path(root_path / 'goodreads_page.html').open('w', encoding='utf-8') as html_page:
-                    html_page.write(response.text)
-
-            if metadata['skip'] is True:
-                break
-            parsed = BeautifulSoup(response.text, 'html.parser')
-            if parsed.select_one('#bookTitle') is not None:
-                metadata = scrape_goodreads_type1(parsed, metadata, log)
-                break
-            elif parsed.select_one("script[type='application/ld+json']") is not None:
-                metadata = scrape_goodreads_type2(parsed, metadata, log)
-                break
-
-    if metadata['failed'] is True:
-        failed_books.append(f"{metadata['input_folder']} ({metadata['failed_exception']})")
-    if metadata['skip'] is True:
-        continue
-
-    print(f"""
-Title: {metadata['title']}
-Author: {metadata['author']}
-URL: {metadata['url']}""")
-
-    # ----- [--output] Prepare output folder -----
-    if args.output:
-        output_path = Path(args.output)
-    else:
-        output_path = folder.parent / f"{default_output}/"
-
-    # - Clean paths -
-    author_clean = re.sub(r"[^\w\-\.\(\) ]+", '', metadata['author'])
-    title_clean = re.sub(r"[^\w\-\.\(\) ]+", '', metadata['title'])
-    log.info(f"Cleaned path names: Author ({author_clean} | Title ({title_clean}")
-    author_folder = output_path / f"{author_clean}/"
-    author_folder.resolve()
-    author_folder.mkdir(parents=True, exist_ok=True)
-    final_output = author_folder / f"{title_clean}/"
-    metadata['final_output'] = final_output.resolve()
-
-    print(f"\nOutput: {metadata['final_output']}")
-
-    # ----- [--copy] Copy/move book folder ---
-    if args.copy:
-        print("\nCopying...")
-        shutil.copytree(folder, metadata['final_output'], dirs_exist_ok=True, copy_function=shutil.copy2)
-    else:  # - Move folder (defult) -
-        print("\nMoving...")
+    if args.watch and not Path(args.watch).is_dir():
+        print(f"\nThe watch path is not a directory or does not exist: {Path(args.watch).resolve()}")
+        sys.exit()
+
+    # --- [--profile] Checked now, the trace is only written after the run ---
+    trace_file = Path(args.profile_output or 'profile.json').resolve()
+    args.profile = args.profile or bool(args.profile_output)
+    if args.profile and (trace_file.is_dir() or not trace_file.parent.is_dir()):
+        print(f"\nThe profile output is a directory or its folder does not exist: {trace_file}")
+        sys.exit()
+
+
+    if not args.debug:
+        # --- Logging disabled ---
+        log.disable(log.CRITICAL)
+
+    # --- [--profile] Spans are only recorded when enabled ---
+    if args.profile:
+        profiler.enable()
+
+    # --- [--import-metadata] Fill the local mirror and exit ---
+    if args.import_metadata:
+        from mirror import MetadataMirror
+        mirror = MetadataMirror(mirror_file)
+        print(f"\nImporting: {Path(args.import_metadata).resolve()}")
+        imported = mirror.import_jsonl(args.import_metadata, log)
+        mirror.close()
+        print(f"\nImported {imported} product records into {mirror_file}")
+        sys.exit()
+
+    # ===== Create Path() objects for each argument folder =====
+    folders = [Path(argument).resolve() for argument in args.folders]
+
+    for folder in folders:
+        # --- Verify integrity of input folders ---
+        exists = folder.is_dir()
+        if not exists:
+            print(f"The input folder '{folder.name}' does not exist or is not a directory...")
+            input('Press enter to exit...')
+            sys.exit()
+
+    log.debug(folders)
+
+    # ===== Organize the folders given, then [--watch] keep organizing new ones as they settle =====
+    organizer = Organizer(args, log, data_dir=root_path)
+    results = []
+    if args.scan:  # - Books are queued as the walk finds them -
+        skip = [default_output] + ([Path(args.output).resolve()] if args.output else [])
+        print(f"\nScanning: {Path(args.scan).resolve()}")
+        results = organizer.organize(LibraryScan(args.scan, log, args.scan_workers, skip).start(), resume=args.resume)
+    elif folders or args.resume:
+        results = organizer.organize(folders, resume=args.resume)
+
+    if args.watch:
+        if results:  # - Folders given on the command line (or scanned) are summarised before watching -
+            print_summary(results)
+        ignore = [Path(args.watch).resolve() / default_output] + ([Path(args.output).resolve()] if args.output else [])
+        folder_watcher = FolderWatcher(args.watch, watch_file, log, args.watch_quiet, ignore)
+        watching = f"\n\nWatching: {folder_watcher.directory} (folders are processed after {args.watch_quiet:g}s without changes, Ctrl+C to stop)"
+        print(watching)
         try:
-            folder.rename(metadata['final_output'])
-        except Exception as e:
-            log.info(f"Couldn't move folder directly, performing copy-move (metadata['title']) | {e}")
-            shutil.copytree(folder, metadata['final_output'], dirs_exist_ok=True, copy_function=shutil.copy2)
-            shutil.rmtree(folder)
-
-    # ----- [--flatten] Flatten Book Folders -----
-    if args.flatten:
-        print('\nFlattening...')
-        flatten_folder(metadata, log)
-
-    # ----- [--rename] Rename audio tracks -----
-    if args.rename:
-        print('\nRenaming...')
-        rename_tracks(metadata, log)
-
-    # ----- [--opf] Create .opf file -----
-    if args.opf:
-        print("\nCreating 'metadata.opf'")
-        create_opf(metadata, opf_template)
-
-    # ----- [--i] Create info.txt file -----
-    if args.infotxt:
-        print("\nCreating 'info.txt'")
-        create_info(metadata)
-
-    # ---- Folder complete ----
-    print("\nDone!")
-    success_books.append(f"{folder.stem}/ --> {output_path.stem}/{metadata['author']}/{metadata['title']}/")
-
-
-# ===== Summary =====
-if failed_books:
-    log.critical(f"Failed metadata scrapes: {','.join(failed_books)}")
-    print('\n\n====================================== FAILURES ======================================')
-    for failure in failed_books:
-        print(f"\nFailed: {failure}", end='')
-    print()
-    if skipped_books:
-        print('\n\n====================================== SKIPPED ======================================')
-        for skipped in skipped_books:
-            print(f"\nSkipped: {skipped}", end='')
-        print()
-    if success_books:
-        print('\n\n====================================== SUCCESS ======================================')
-        for book in success_books:
-            print(f"\nSuccess: {book}", end='')
-    print('\n\n====================================== WARNING ======================================')
-    print('\nSome books did not get processed successfully...\n')
-    input('press enter to exit...')
-    sys.exit()
-else:
-    log.info('Completed without errors')
-    if skipped_books:
-        print('\n\n====================================== SKIPPED ======================================')
-        for skipped in skipped_books:
-            print(f"\nSkipped: {skipped}", end='')
-        print()
-    print('\n\n====================================== SUCCESS ======================================')
-    for book in success_books:
-        print(f"\nSuccess: {book}", end='')
-    print('\n\n====================================== COMPLETE ======================================')
-    print('\nCheers to the community providing our content and building our tools!\n')
-    input('Press enter to exit...')
+            for batch in folder_watcher.batches():
+                print(f"\nNew folders: {', '.join(folder.name for folder in batch)}")
+                handled = organizer.organize(batch)
+                print_summary(handled)
+                # - Failed books (eg: out of network retries) are tried again later, the rest are remembered as handled -
+                failed = [result['folder'] for result in handled if result['status'] == 'failed']
+                for folder, delay in folder_watcher.finished(batch, remember=not args.dry_run, failed=failed).items():
+                    print(f"\nRetrying {Path(folder).name} in {delay / 60:.0f} minutes")
+                print(watching)
+        except KeyboardInterrupt:
+            print('\nStopped watching')
+        finally:
+            folder_watcher.close()
+
+    # ===== Summary =====
+    organizer.close()
+    print(f"\n\nMetadata cache: {organizer.cache.hits} hits, {organizer.cache.misses} misses", end='')
+    if organizer.analyser is not None:
+        print(f"\nAudio analysis: {organizer.analyser.misses} tracks read, {organizer.analyser.hits} cached", end='')
+
+    if args.profile:
+        profiler.write_trace(trace_file)
+        print(f"\n\n===================================== PROFILE ======================================\n\n{profiler.table()}")
+        print(f"\nTrace written to: {trace_file}", end='')
+
+    if not args.watch:
+        print_summary(results)
+        input('Press enter to exit...')
     sys.exit()
+
+
+if __name__ == '__main__':
+    main()
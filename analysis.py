@@ -0,0 +1,115 @@
+# --- [--analyze] Duration, bitrate and channels of every track, read in a process pool and cached per file ---
+import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from optional import scan_book
+from profiler import profiler
+
+
+def load_tinytag():
+    # --- Worker start-up, the first book doesn't wait on the import ---
+    import tinytag  # noqa: F401
+
+
+def read_track(path):
+    # --- Runs in a worker process, a file that can't be parsed counts with no duration ---
+    from tinytag import TinyTag
+    try:
+        track = TinyTag.get(path)
+    except Exception as exc:
+        return {'duration': 0.0, 'bitrate': 0.0, 'channels': 0, 'samplerate': 0, 'error': str(exc)}
+    return {'duration': track.duration or 0.0, 'bitrate': track.bitrate or 0.0, 'channels': track.channels or 0, 'samplerate': track.samplerate or 0}
+
+
+def audio_files(book_path):
+    # --- Every audio file under a book folder, in path order, as strings for the cache keys ---
+    return [str(path) for path in scan_book(book_path)[0]]
+
+
+def summarise(book_path, tracks):
+    # ----- Totals of a book, 'files' keeps each track relative to the book folder -----
+
+    duration = sum(track['duration'] for track in tracks.values())
+    bitrate = sum(track['bitrate'] * track['duration'] for track in tracks.values()) / duration if duration else 0.0  # Weighted by length
+    return {
+        'duration': round(duration, 3),
+        'runtime': runtime(duration),
+        'tracks': len(tracks),
+        'bitrate': round(bitrate, 1),
+        'channels': max([track['channels'] for track in tracks.values()] or [0]),
+        'samplerate': max([track['samplerate'] for track in tracks.values()] or [0]),
+        'files': [dict(track, file=os.path.relpath(path, book_path)) for path, track in tracks.items()],
+    }
+
+
+def runtime(seconds):
+    # --- 'H:MM:SS' ---
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class AudioAnalyser:
+    # ----- Shared by every book, tracks are read across CPU-bound worker processes -----
+    # - Results are cached in SQLite by (path, size, mtime), an unchanged file is never parsed twice -
+
+    def __init__(self, path, log, workers=None):
+        self.log = log
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS tracks (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, data TEXT)")
+        self.db.commit()
+        # - Workers are forked here, before the pipeline starts any threads, and import tinytag straight away -
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.executor.submit(load_tinytag)
+
+    def lookup(self, files):
+        # --- {path: cached track} for files unchanged since they were read, plus {path: (size, mtime)} of all ---
+        stats = {}
+        for file in files:
+            stat = os.stat(file)
+            stats[file] = (stat.st_size, stat.st_mtime_ns)
+        cached = {}
+        with self.lock:
+            for path, (size, mtime) in stats.items():
+                row = self.db.execute("SELECT size, mtime, data FROM tracks WHERE path = ?", (path,)).fetchone()
+                if row is not None and row[0] == size and row[1] == mtime:
+                    cached[path] = json.loads(row[2])
+        return cached, stats
+
+    def store(self, tracks, stats):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO tracks (path, size, mtime, data) VALUES (?, ?, ?, ?)",
+                                [(path, *stats[path], json.dumps(track)) for path, track in tracks.items()])
+            self.db.commit()
+
+    def analyse(self, book_path, book=''):
+        # ----- Audio summary of a book folder, called from the post-processing threads -----
+
+        with profiler.span('analyze', book) as span:
+            files = audio_files(book_path)
+            cached, stats = self.lookup(files)
+            missing = [path for path in stats if path not in cached]
+            chunk = max(1, len(missing) // (self.workers * 4))
+            read = dict(zip(missing, self.executor.map(read_track, missing, chunksize=chunk)))
+            for path, track in read.items():
+                if 'error' in track:
+                    self.log.info(f"Audio analysis couldn't read {path} | {track['error']}")
+            self.store(read, stats)
+            with self.lock:
+                self.hits += len(cached)
+                self.misses += len(read)
+            span.set(tracks=len(stats), read=len(read))
+        tracks = {path: cached[path] if path in cached else read[path] for path in stats}
+        return summarise(book_path, tracks)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            self.db.close()
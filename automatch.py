@@ -0,0 +1,134 @@
+# --- [--auto] Match well-tagged books through the Audible catalog search, without the clipboard ---
+import re
+import unicodedata
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+
+
+# --- How much each comparison counts, re-weighted over the ones the tags can provide ---
+weights = {
+    'title': 0.55,
+    'author': 0.30,
+    'narrator': 0.10,
+    'duration': 0.05,
+}
+ambiguity_margin = 0.05  # The best candidate must beat the runner-up by this much
+
+
+def normalise(text):
+    # --- Lowercase ascii words, without punctuation or '(Unabridged)'/'(Book 2)' style suffixes ---
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    text = text.lower().replace('&', ' and ')
+    text = re.sub(r"\((?:un)?abridged\)|\((?:book|volume|vol\.?|part) [\d.]+\)", ' ', text)
+    text = re.sub(r"[^\w\s]", ' ', text)
+    return ' '.join(text.split())
+
+
+def similarity(first, second):
+    # --- 0..1, the better of a character ratio and a word overlap (handles reordered names) ---
+    first = normalise(first)
+    second = normalise(second)
+    if not first or not second:
+        return 0.0
+    ratio = SequenceMatcher(None, first, second).ratio()
+    first_words = set(first.split())
+    second_words = set(second.split())
+    overlap = len(first_words & second_words) / len(first_words | second_words)
+    return max(ratio, overlap)
+
+
+def score(candidate, tags):
+    # ----- Confidence (0..1) that an Audible product is the tagged book -----
+
+    scores = {}
+    titles = [candidate.get('title', '')]
+    if candidate.get('subtitle'):
+        titles.append(f"{candidate['title']} {candidate['subtitle']}")
+    scores['title'] = max(similarity(tags['title'], title) for title in titles)
+
+    if tags.get('author'):
+        scores['author'] = max([similarity(tags['author'], author.get('name', '')) for author in candidate.get('authors', [])] or [0.0])
+
+    if tags.get('narrator') and candidate.get('narrators'):
+        scores['narrator'] = max(similarity(tags['narrator'], narrator.get('name', '')) for narrator in candidate['narrators'])
+
+    if tags.get('duration') and candidate.get('runtime_length_min'):
+        runtime = candidate['runtime_length_min'] * 60
+        difference = abs(tags['duration'] - runtime) / runtime
+        scores['duration'] = max(0.0, 1 - max(0.0, difference - 0.02) / 0.18)  # Full marks within 2%, none past 20%
+
+    total = sum(weights[name] for name in scores)
+    return sum(scores[name] * weights[name] for name in scores) / total
+
+
+def product_url(product):
+    # --- A product page url the rest of the script recognises (urls.audible_url) ---
+    slug = re.sub(r"[^\w]+", '-', normalise(product.get('title', ''))).strip('-').title() or 'Book'
+    return f"https://www.audible.com/pd/{slug}-Audiobook/{product['asin']}"
+
+
+def choose(candidates, tags, threshold):
+    # --- (best score, best product, reason), the product is None when a human should decide ---
+    ranked = sorted(((score(product, tags), product) for product in candidates), key=lambda pair: pair[0], reverse=True)
+    best_score, best = ranked[0]
+    if best_score < threshold:
+        return best_score, None, f"low confidence {best_score:.2f}"
+    if len(ranked) > 1 and best_score - ranked[1][0] < ambiguity_margin and ranked[1][1]['asin'] != best['asin']:
+        return best_score, None, f"ambiguous, {best_score:.2f} vs {ranked[1][0]:.2f}"
+    return best_score, best, ''
+
+
+def match_folder(folder, prober, log, threshold, mirror=None):
+    # --- Search for a folder and pick a candidate, 'url' is None when a human should decide ---
+
+    tags = prober.probe(folder)
+    result = {'tags': tags, 'url': None, 'product': None, 'score': 0.0, 'reason': ''}
+    if not tags['title']:
+        result['reason'] = 'no title tag'
+        return result
+
+    # - The local mirror is tried first, the catalog search only runs when it isn't conclusive -
+    if mirror is not None:
+        candidates = [match['product'] for match in mirror.search(tags['title'], tags['author'], limit=10)]
+        if candidates:
+            result['score'], product, result['reason'] = choose(candidates, tags, threshold)
+            if product is not None:
+                log.info(f"Auto match ({folder.name}): local mirror '{product.get('title')}' ({product['asin']}) scored {result['score']:.3f}")
+                result.update({'url': product_url(product), 'product': product})
+                return result
+
+    from scrapers import audible_search  # Only loaded once a search is needed, the mirror uses the scoring alone
+    candidates = [product for product in audible_search(tags['title'], tags['author'], log, folder.name) if product.get('asin')]
+    if not candidates:
+        result['reason'] = 'no search results'
+        return result
+
+    result['score'], product, result['reason'] = choose(candidates, tags, threshold)
+    log.info(f"Auto match ({folder.name}): search scored {result['score']:.3f} ({result['reason'] or 'accepted'})")
+    if product is not None:
+        result.update({'url': product_url(product), 'product': product})
+    return result
+
+
+def auto_match(folders, prober, log, threshold=0.85, workers=4, mirror=None):
+    # ----- Search for every folder concurrently, yielding (folder, result, output) in folder order -----
+    # - 'folders' can be a stream ([--scan]), results are yielded while it's still being read -
+    from fetch import run_captured
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = deque()
+        for folder in folders:
+            pending.append((folder, executor.submit(run_captured, match_folder, folder, prober, log, threshold, mirror)))
+            while pending and pending[0][1].done():
+                yield match_result(*pending.popleft(), log)
+        while pending:
+            yield match_result(*pending.popleft(), log)
+
+
+def match_result(folder, future, log):
+    try:
+        result, output = future.result()
+    except Exception as exc:
+        log.error(f"Auto match error ({folder}): {exc}")
+        result, output = {'tags': None, 'url': None, 'product': None, 'score': 0.0, 'reason': f"error: {exc}"}, ''
+    return folder, result, output
@@ -0,0 +1,217 @@
+# --- Offline benchmark of every pipeline stage, results are written as JSON ---
+#
+#   python benchmarks/run.py --books 100 --output bench.json
+#
+import argparse
+import json
+import logging as log
+import platform
+import re
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+
+benchmarks_path = Path(__file__).resolve().parent
+root_path = benchmarks_path.parent
+sys.path.insert(0, str(root_path))
+sys.path.insert(0, str(benchmarks_path))
+
+from bs4 import BeautifulSoup
+
+import scrapers
+from scrapers import http_request, api_audible, scrape_goodreads_type1, scrape_goodreads_type2, goodreads_fast_parse
+from optional import create_opf, create_info, flatten_folder, rename_tracks
+from copier import copy_book
+from fetch import new_metadata
+from tags import probe_tags
+from stub_server import StubServer, StubTransport, fixtures_path
+from synthetic import build_library
+
+stages = ['tag_probe', 'http_request', 'api_audible', 'goodreads_full_parse', 'goodreads_fast_parse', 'scrape_goodreads_type1',
+          'scrape_goodreads_type2', 'copy', 'move', 'flatten_folder', 'rename_tracks', 'create_opf', 'create_info']
+
+
+class StageTimer:
+    # --- Collects one duration per stage per book ---
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.durations = {stage: [] for stage in enabled}
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+        yield
+        self.durations[stage].append(time.perf_counter() - start)
+
+    def summary(self):
+        results = {}
+        for stage, durations in self.durations.items():
+            if not durations:
+                continue
+            ordered = sorted(durations)
+            results[stage] = {
+                'count': len(ordered),
+                'total_s': round(sum(ordered), 6),
+                'mean_ms': round(sum(ordered) / len(ordered) * 1000, 4),
+                'p50_ms': round(percentile(ordered, 50) * 1000, 4),
+                'p95_ms': round(percentile(ordered, 95) * 1000, 4),
+                'max_ms': round(ordered[-1] * 1000, 4),
+            }
+        return results
+
+
+def percentile(ordered, percent):
+    # --- Nearest-rank percentile of an already sorted list ---
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def benchmark(books, timer, workdir, fixtures, log):
+    # ----- Run every enabled stage over every book -----
+
+    server = StubServer(fixtures, mix_layouts=True).start()
+    scrapers.configure_client(rate=0, transport=StubTransport(server))
+    product = json.loads((Path(fixtures) / 'audible_product.json').read_text(encoding='utf-8'))['product']
+    type1_page = (Path(fixtures) / 'goodreads_type1.html').read_text(encoding='utf-8')
+    type2_page = (Path(fixtures) / 'goodreads_type2.html').read_text(encoding='utf-8')
+    type1_parsed = BeautifulSoup(type1_page, 'html.parser')
+    type2_parsed = BeautifulSoup(type2_page, 'html.parser')
+    enabled = timer.enabled
+
+    for number, book in enumerate(books):
+        if number % 2:
+            url = f"https://www.audible.com/pd/Synthetic-Book-Audiobook/B{number:09d}"
+        else:
+            url = f"https://www.goodreads.com/book/show/{number + 1}"
+        metadata = new_metadata(book, url)
+
+        if 'tag_probe' in enabled:
+            with timer.time('tag_probe'):
+                probe_tags(book, log)
+
+        if 'http_request' in enabled:
+            with timer.time('http_request'):
+                if number % 2:
+                    query = {'response_groups': scrapers.audible_response_groups}
+                    http_request(metadata, log, f"{scrapers.audible_products_url}/B{number:09d}", query)
+                else:
+                    http_request(metadata, log)
+
+        if 'api_audible' in enabled:
+            with timer.time('api_audible'):
+                metadata = api_audible(new_metadata(book, url), product, log)
+        if 'goodreads_full_parse' in enabled:
+            with timer.time('goodreads_full_parse'):
+                BeautifulSoup(type2_page, 'html.parser')
+        if 'goodreads_fast_parse' in enabled:
+            with timer.time('goodreads_fast_parse'):
+                goodreads_fast_parse(type2_page)
+        if 'scrape_goodreads_type1' in enabled:
+            with timer.time('scrape_goodreads_type1'):
+                scrape_goodreads_type1(type1_parsed, new_metadata(book, url), log)
+        if 'scrape_goodreads_type2' in enabled:
+            with timer.time('scrape_goodreads_type2'):
+                scrape_goodreads_type2(type2_parsed, new_metadata(book, url), log)
+
+        # - Filesystem stages work on a copy so the library can be reused -
+        metadata = api_audible(new_metadata(book, url), product, log)
+        metadata['title'] = f"{metadata['title']} {number}"
+        copied = workdir / 'copied' / book.name
+        final_output = workdir / 'organized' / re.sub(r"[^\w\-\.\(\) ]+", '', metadata['author']) / re.sub(r"[^\w\-\.\(\) ]+", '', metadata['title'])
+        final_output.parent.mkdir(parents=True, exist_ok=True)
+        with timer.time('copy') if 'copy' in enabled else nullcontext():
+            copy_book(book, copied, log, show_progress=False)
+        with timer.time('move') if 'move' in enabled else nullcontext():
+            copied.rename(final_output)
+        metadata['final_output'] = final_output
+
+        if 'flatten_folder' in enabled:
+            with timer.time('flatten_folder'):
+                flatten_folder(metadata, log)
+        if 'rename_tracks' in enabled:
+            with timer.time('rename_tracks'):
+                rename_tracks(metadata, log)
+        if 'create_opf' in enabled:
+            with timer.time('create_opf'):
+                create_opf(metadata, root_path / 'template.opf')
+        if 'create_info' in enabled:
+            with timer.time('create_info'):
+                create_info(metadata)
+
+    server.shutdown()
+
+
+def library_size(books):
+    files = 0
+    size = 0
+    for book in books:
+        for file in book.rglob('*'):
+            if file.is_file():
+                files += 1
+                size += file.stat().st_size
+    return files, size
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python benchmarks/run.py', description='Time every BadaBoomBooks stage against a synthetic library and local fixtures')
+    parser.add_argument('--books', type=int, default=100, help='Number of synthetic books (default: 100)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic library layout (default: 0)')
+    parser.add_argument('--min-size', type=int, default=1024, help='Smallest audio stub in bytes (default: 1024)')
+    parser.add_argument('--max-size', type=int, default=256 * 1024, help='Largest audio stub in bytes (default: 262144)')
+    parser.add_argument('--stages', default=','.join(stages), help=f"Comma separated stages to time (default: all)\n{', '.join(stages)}")
+    parser.add_argument('--fixtures', default=str(fixtures_path), help='Folder with audible_product.json, goodreads_type1.html and goodreads_type2.html')
+    parser.add_argument('--workdir', help='Where to build the library (default: a temporary folder, removed afterwards)')
+    parser.add_argument('--output', default='-', help="JSON results file, '-' for stdout (default: -)")
+    args = parser.parse_args()
+
+    enabled = [stage for stage in args.stages.split(',') if stage]
+    unknown = [stage for stage in enabled if stage not in stages]
+    if unknown:
+        parser.error(f"unknown stage(s): {', '.join(unknown)}")
+
+    log.disable(log.CRITICAL)
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix='badaboombooks-bench-')).resolve()
+    version = re.search(r"__version__ = ([\d.]+)", (root_path / 'BadaBoomBooks.py').read_text(encoding='utf-8'))[1]
+
+    try:
+        started = time.perf_counter()
+        books = build_library(workdir / 'library', args.books, args.seed, args.min_size, args.max_size)
+        generated = time.perf_counter() - started
+        files, size = library_size(books)
+
+        timer = StageTimer(enabled)
+        benchmark(books, timer, workdir, args.fixtures, log)
+
+        results = {
+            'benchmark': 'BadaBoomBooks',
+            'version': version,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'books': args.books,
+            'files': files,
+            'bytes': size,
+            'seed': args.seed,
+            'library_generation_s': round(generated, 6),
+            'stages': timer.summary(),
+        }
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        Path(args.output).write_text(output + '\n', encoding='utf-8')
+        for stage, stats in results['stages'].items():
+            print(f"{stage:<24} p50 {stats['p50_ms']:>10.3f} ms   p95 {stats['p95_ms']:>10.3f} ms   total {stats['total_s']:>9.3f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+# --- Local stand-in for api.audible.com and goodreads.com, replays the recorded fixtures ---
+import json
+import re
+import threading
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+from requests.adapters import HTTPAdapter
+
+fixtures_path = Path(__file__).resolve().parent / 'fixtures'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # --- Routes: /1.0/catalog/products[/<asin>] (by asins or a title/author search) and /book/show/<id> ---
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        with server.lock:
+            server.requests.append(self.path)
+            error = server.take_error(self.path)
+        if error is not None:
+            status, retry_after = error
+            if status == 0:  # Drop the connection without a response
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            if status == -1:  # Stall, the request is read but never answered while the server runs
+                server.released.wait()
+                self.close_connection = True
+                return
+            return self.reply(status, 'injected error', 'text/plain', {'Retry-After': retry_after} if retry_after is not None else {})
+
+        single = re.match(r"^/1\.0/catalog/products/(\w{10})$", url.path)
+        if single:
+            return self.reply(200, json.dumps({'product': server.product(single[1])}), 'application/json')
+        if url.path == '/1.0/catalog/products' and 'asins' in query:
+            asins = query['asins'][0].split(',')
+            return self.reply(200, json.dumps({'products': [server.product(asin) for asin in asins if asin]}), 'application/json')
+        if url.path == '/1.0/catalog/products':
+            return self.reply(200, json.dumps({'products': server.search(query.get('title', [''])[0], query.get('author', [''])[0])}), 'application/json')
+        book = re.match(r"^/book/show/(\d+)", url.path)
+        if book:
+            page = server.goodreads_type1 if int(book[1]) % 2 == 0 and server.mix_layouts else server.goodreads_type2
+            return self.reply(200, page, 'text/html')
+        return self.reply(404, 'not found', 'text/plain')
+
+    def reply(self, status, body, content_type, headers={}):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    # ----- Serves the fixtures on 127.0.0.1, start() runs it in a daemon thread -----
+
+    daemon_threads = True
+
+    def __init__(self, fixtures=fixtures_path, mix_layouts=False):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        fixtures = Path(fixtures)
+        self.audible_product = json.loads((fixtures / 'audible_product.json').read_text(encoding='utf-8'))['product']
+        self.goodreads_type1 = (fixtures / 'goodreads_type1.html').read_text(encoding='utf-8')
+        self.goodreads_type2 = (fixtures / 'goodreads_type2.html').read_text(encoding='utf-8')
+        self.mix_layouts = mix_layouts  # Even goodreads ids get the old (type1) layout
+        self.requests = []
+        self.errors = []  # [match, status, retry_after, remaining], see inject()
+        self.lock = threading.Lock()
+        self.released = threading.Event()  # Lets go of stalled requests
+
+    def inject(self, status, count=1, match='', retry_after=None):
+        # --- Answer the next 'count' requests whose path contains 'match' with 'status' (0 drops the connection, -1 stalls it) ---
+        with self.lock:
+            self.errors.append([match, status, retry_after, count])
+        return self
+
+    def take_error(self, path):
+        # --- (status, retry_after) of an injected error for this request, None to serve it normally ---
+        for error in self.errors:
+            if error[0] in path and error[3] > 0:
+                error[3] -= 1
+                return error[1], error[2]
+        return None
+
+    def product(self, asin):
+        product = dict(self.audible_product)
+        product['asin'] = asin
+        return product
+
+    def search(self, title, author):
+        # --- A product matching the query, followed by the fixture product as a decoy ---
+        asin = f"S{zlib.crc32(f'{title}|{author}'.encode()):09d}"[:10]
+        match = self.product(asin)
+        match.update({'title': title, 'subtitle': '', 'authors': [{'name': author}] if author else []})
+        return [match, self.audible_product]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def server_close(self):
+        self.released.set()
+        super().server_close()
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.server_address[1]}"
+
+
+class StubTransport(HTTPAdapter):
+    # --- requests adapter that sends every request to the stub server, for scrapers.configure_client(transport=...) ---
+
+    def __init__(self, server, **kwargs):
+        self.server = server
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        request.url = url._replace(scheme='http', netloc=self.server.address).geturl()
+        return super().send(request, **kwargs)
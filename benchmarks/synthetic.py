@@ -0,0 +1,62 @@
+# --- Synthetic audiobook library, nested folders of tagged mp3/m4b stubs ---
+import random
+import struct
+from pathlib import Path
+
+
+def atom(name, payload):
+    return struct.pack('>I', 8 + len(payload)) + name + payload
+
+
+def m4b_stub(album, artist, size):
+    # --- Minimal mp4 with ©alb/©ART tags in moov/udta/meta/ilst, padded with an mdat of 'size' bytes ---
+    def data(text):
+        return atom(b'data', struct.pack('>II', 1, 0) + text.encode('utf-8'))
+    ilst = atom(b'ilst', atom(b'\xa9alb', data(album)) + atom(b'\xa9ART', data(artist)))
+    meta = atom(b'meta', b'\x00' * 4 + atom(b'hdlr', b'\x00' * 8 + b'mdir' + b'\x00' * 12) + ilst)
+    return atom(b'ftyp', b'M4B \x00\x00\x02\x00M4B isom') + atom(b'moov', atom(b'udta', meta)) + atom(b'mdat', b'\x00' * size)
+
+
+def mp3_stub(album, artist, title, size):
+    # --- ID3v2.4 header with TALB/TPE1/TIT2 frames, followed by 'size' bytes of padding ---
+    def frame(frame_id, text):
+        body = b'\x03' + text.encode('utf-8')
+        return frame_id + struct.pack('>I', len(body)) + b'\x00\x00' + body
+    frames = frame(b'TALB', album) + frame(b'TPE1', artist) + frame(b'TIT2', title)
+    length = len(frames)
+    syncsafe = bytes([(length >> 21) & 127, (length >> 14) & 127, (length >> 7) & 127, length & 127])
+    return b'ID3\x04\x00\x00' + syncsafe + frames + b'\x00' * size
+
+
+def build_library(root, books, seed=0, min_size=1024, max_size=256 * 1024):
+    # ----- Create 'books' book folders under root, returns their paths -----
+    # - 40% single m4b, 40% flat mp3 chapters, 20% multi-disc mp3, file sizes log-uniform in [min_size, max_size] -
+
+    rng = random.Random(seed)
+    root = Path(root)
+    paths = []
+
+    def size():
+        return int(min_size * (max_size / min_size) ** rng.random())
+
+    for number in range(books):
+        album = f"Synthetic Book {number}"
+        artist = f"Author {number % 97}"
+        folder = root / f"{artist} - {album}"
+        folder.mkdir(parents=True, exist_ok=True)
+        kind = rng.random()
+        if kind < 0.4:
+            (folder / f"{album}.m4b").write_bytes(m4b_stub(album, artist, size()))
+        elif kind < 0.8:
+            for chapter in range(rng.randint(5, 30)):
+                (folder / f"Chapter {chapter + 1:02}.mp3").write_bytes(mp3_stub(album, artist, f"Chapter {chapter + 1}", size()))
+        else:
+            for disc in range(rng.randint(2, 6)):
+                disc_folder = folder / f"CD{disc + 1}"
+                disc_folder.mkdir(exist_ok=True)
+                for track in range(rng.randint(3, 12)):
+                    (disc_folder / f"Track {track + 1:02}.mp3").write_bytes(mp3_stub(album, artist, f"Track {track + 1}", size()))
+        (folder / 'cover.jpg').write_bytes(b'\xff\xd8\xff' + b'\x00' * 512)
+        paths.append(folder)
+
+    return paths
@@ -0,0 +1,22 @@
+# --- Web browser the search pages are opened in ---
+import threading
+import webbrowser
+
+
+class WebBrowserBackend:
+    # --- The system browser, a background tab doesn't take the focus from the current one ---
+
+    def open(self, url, background=False):
+        webbrowser.open(url, new=2, autoraise=not background)
+
+
+class FakeBrowser:
+    # --- Records opened pages for tests, open() can be called from the look-ahead threads ---
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.opened = []  # (url, background)
+
+    def open(self, url, background=False):
+        with self.lock:
+            self.opened.append((url, background))
@@ -0,0 +1,78 @@
+# --- Persistent metadata cache, keyed by Audible ASIN or Goodreads book id ---
+import json
+import sqlite3
+import threading
+import time
+
+from urls import audible_asin, goodreads_id
+
+# --- Only the scraped fields are cached, the rest belong to the current run ---
+cached_fields = ['author', 'authors_multi', 'title', 'summary', 'subtitle', 'narrator', 'narrators_multi', 'publisher',
+                 'publishyear', 'genres', 'isbn', 'asin', 'series', 'series_multi', 'volumenumber']
+
+
+def cache_key(url):
+    # --- 'audible:<asin>' or 'goodreads:<id>', False for anything else ---
+    match = audible_asin.search(url)
+    if match:
+        return f"audible:{match[1]}"
+    match = goodreads_id.search(url)
+    if match:
+        return f"goodreads:{match[1]}"
+    return False
+
+
+class MetadataCache:
+    # --- SQLite store of parsed metadata dicts with a TTL and LRU eviction past max_entries ---
+
+    def __init__(self, path, ttl=30 * 24 * 60 * 60, max_entries=20000, refresh=False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh  # Skip lookups, but still store fresh results
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, data TEXT, stored REAL, accessed REAL)")
+        self.db.commit()
+
+    def get(self, url):
+        key = cache_key(url)
+        if not key:
+            return None
+        with self.lock:
+            if self.refresh:
+                self.misses += 1
+                return None
+            row = self.db.execute("SELECT data, stored FROM metadata WHERE key = ?", (key,)).fetchone()
+            if row is None or time.time() - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE metadata SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def peek(self, url):
+        # --- True if get() would hit, without counting it or touching the entry ---
+        key = cache_key(url)
+        if not key or self.refresh:
+            return False
+        with self.lock:
+            row = self.db.execute("SELECT stored FROM metadata WHERE key = ?", (key,)).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl
+
+    def put(self, url, metadata):
+        key = cache_key(url)
+        if not key:
+            return
+        data = json.dumps({field: metadata[field] for field in cached_fields if field in metadata})
+        now = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO metadata (key, data, stored, accessed) VALUES (?, ?, ?, ?)", (key, data, now, now))
+            self.db.execute("DELETE FROM metadata WHERE key IN (SELECT key FROM metadata ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
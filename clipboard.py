@@ -0,0 +1,147 @@
+# --- Clipboard watcher, waits for the user to copy (or paste) a book url ---
+import os
+import queue
+import select
+import sys
+import threading
+import time
+from collections import deque
+
+
+class PyperclipBackend:
+    # --- The system clipboard ---
+
+    def __init__(self):
+        import pyperclip
+        self.pyperclip = pyperclip
+
+    def paste(self):
+        return self.pyperclip.paste()
+
+    def copy(self, text):
+        self.pyperclip.copy(text)
+
+
+class FakeClipboard:
+    # --- In-memory clipboard for tests, set() can be called from another thread ---
+
+    def __init__(self, text=''):
+        self.text = text
+        self.pastes = 0
+        self.changed = None  # time.monotonic() of the last set()
+
+    def set(self, text):
+        self.text = text
+        self.changed = time.monotonic()
+
+    def paste(self):
+        self.pastes += 1
+        return self.text
+
+    def copy(self, text):
+        self.text = text
+
+
+class LineChannel:
+    # --- Urls pasted into the terminal (stdin) or written to a named pipe, one per line ---
+
+    def __init__(self, source):
+        self.lines = queue.Queue()
+        self.source = source
+        self.closed = False
+        self.pending = deque()  # Complete lines read from stdin, not handed out yet
+        self.partial = b''  # Start of a line still being typed
+        if source == 'stdin':
+            # - select() keeps stdin free for the closing input() prompt, consoles on windows need a reader thread -
+            self.selectable = os.name != 'nt'
+        else:
+            if not os.path.exists(source):
+                os.mkfifo(source)
+            self.selectable = False
+        if not self.selectable:
+            threading.Thread(target=self.reader, daemon=True).start()
+
+    def reader(self):
+        if self.source == 'stdin':
+            for line in sys.stdin:
+                self.lines.put(line.strip())
+            return
+        while True:  # Reopen the pipe each time the writer closes it
+            with open(self.source, 'r', encoding='utf-8') as pipe:
+                for line in pipe:
+                    self.lines.put(line.strip())
+
+    def get(self, timeout):
+        if self.selectable:
+            return self.read_stdin(timeout)
+        try:
+            return self.lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def read_stdin(self, timeout):
+        # --- The fd is read directly, a buffered readline() would hide a second pasted line from select() ---
+        if self.pending:
+            return self.pending.popleft()
+        if self.closed:
+            time.sleep(timeout)
+            return None
+        ready, _, _ = select.select([sys.stdin], [], [], timeout)
+        if not ready:
+            return None
+        data = os.read(sys.stdin.fileno(), 64 * 1024)
+        if not data:  # EOF, whatever was left counts as a line
+            self.closed = True
+            data = b'\n'
+        *lines, self.partial = (self.partial + data).split(b'\n')
+        self.pending.extend(line.decode('utf-8', 'replace').strip() for line in lines)
+        return self.pending.popleft() if self.pending else None
+
+
+class ClipboardWatcher:
+    # ----- Poll the clipboard quickly right after a search opens, slowing down the longer the user takes -----
+
+    def __init__(self, backend, channel=None, fast_interval=0.1, slow_interval=1.0, fast_period=20, sleep=time.sleep):
+        self.backend = backend
+        self.channel = channel
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.fast_period = fast_period
+        self.sleep = sleep
+        self.armed = time.monotonic()
+        self.last = None
+
+    def interval(self):
+        elapsed = time.monotonic() - self.armed
+        if elapsed < self.fast_period:
+            return self.fast_interval
+        # - Back off linearly to the slow interval over another fast_period -
+        ratio = min(1.0, (elapsed - self.fast_period) / self.fast_period)
+        return self.fast_interval + (self.slow_interval - self.fast_interval) * ratio
+
+    def arm(self, current):
+        # --- Call once the browser opens, 'current' is what's on the clipboard now ---
+        self.armed = time.monotonic()
+        self.last = current
+
+    def next(self):
+        # --- Block until the clipboard changes or a line arrives on the channel, then return it ---
+        while True:
+            interval = self.interval()
+            if self.channel is not None:
+                line = self.channel.get(interval)  # Waiting on the channel doubles as the poll delay
+                if line:
+                    return line
+            else:
+                self.sleep(interval)
+
+            current = self.backend.paste()
+            if current != self.last:
+                self.last = current
+                return current
+
+    def paste(self):
+        return self.backend.paste()
+
+    def copy(self, text):
+        self.backend.copy(text)
@@ -0,0 +1,233 @@
+# --- Copy engine for --copy, --link and cross-device moves, copies the files of a book in parallel ---
+import errno
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+chunk_size = 64 * 1024 * 1024
+FICLONE = 0x40049409  # linux/fs.h, reflink a whole file on btrfs/xfs
+
+# --- Errors that mean "this filesystem can't link this file", the next method is tried ---
+# - Only EXDEV (source and output on different devices) falls back to a real copy on its own -
+unsupported_errors = {errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOTTY, errno.EMLINK}
+
+
+def zero_copy(source, destination, size, progress=None):
+    # --- Kernel-side copy, returns False if neither copy_file_range nor sendfile work here ---
+    # - Progress is counted per chunk, a large single-file book doesn't sit at 0 until it's done -
+    copied = 0
+    for method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, method):
+            continue
+        try:
+            while copied < size:
+                if method == 'copy_file_range':
+                    sent = os.copy_file_range(source.fileno(), destination.fileno(), min(chunk_size, size - copied))
+                else:
+                    sent = os.sendfile(destination.fileno(), source.fileno(), copied, min(chunk_size, size - copied))
+                if sent == 0:
+                    break
+                copied += sent
+                if progress is not None:
+                    progress.add(sent)
+        except OSError:
+            if copied:  # Failed part way through, don't mix methods
+                raise
+            continue
+        if copied == size:
+            return True
+        if copied:
+            raise OSError(f"Short copy, {copied} of {size} bytes")
+    return False
+
+
+def copy_file(source, destination, progress=None):
+    # --- Copy one file with its metadata (like shutil.copy2), returns bytes copied ---
+    size = os.stat(source).st_size
+    if os.path.lexists(destination):  # Never write through a hardlink left by --link
+        os.remove(destination)
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        if size == 0 or not zero_copy(src, dst, size, progress):
+            while True:
+                data = src.read(1024 * 1024)
+                if not data:
+                    break
+                dst.write(data)
+                if progress is not None:
+                    progress.add(len(data))
+    shutil.copystat(source, destination)
+    return size
+
+
+def reflink(source, destination):
+    import fcntl
+    if os.path.lexists(destination):
+        os.remove(destination)
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, destination)
+
+
+def hardlink(source, destination):
+    if os.path.lexists(destination):
+        os.remove(destination)
+    os.link(source, destination)
+
+
+def link_file(source, destination, mode, fallback=None):
+    # --- Link instead of copying, returns the method that worked ('reflink', 'hard' or 'copy') ---
+    # - A filesystem that can't link at all raises, unless [--link-fallback copy] allows a real copy -
+    methods = {'hard': ['hard'], 'reflink': ['reflink'], 'auto': ['reflink', 'hard']}[mode]
+    error = None
+    for method in methods:
+        try:
+            if method == 'reflink':
+                reflink(source, destination)
+            else:
+                hardlink(source, destination)
+            return method
+        except (OSError, ImportError) as e:
+            if method == 'reflink' and os.path.exists(destination):
+                os.remove(destination)
+            if isinstance(e, OSError) and e.errno == errno.EXDEV:  # Different devices, no method can link across them
+                break
+            if isinstance(e, OSError) and e.errno not in unsupported_errors:
+                raise
+            error = e
+    else:
+        if fallback != 'copy':
+            raise OSError(f"--link {mode} isn't supported here ({source}): {error}, pass --link-fallback copy to copy these files instead")
+    copy_file(source, destination)
+    return 'copy'
+
+
+class Progress:
+    # --- Thread-safe byte counter, printed as a single updating line by the calling thread ---
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        with self.lock:
+            self.done += count
+
+    def rate(self):
+        return self.done / max(time.monotonic() - self.started, 0.001)
+
+    def line(self):
+        return f"{self.done / 1048576:,.0f} / {self.total / 1048576:,.0f} MB ({self.rate() / 1048576:,.1f} MB/s)"
+
+
+class ProgressBoard:
+    # --- Copies running across the post-processing pool, summed into one line for the main thread to print ---
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = []
+
+    def add(self, progress):
+        with self.lock:
+            self.active.append(progress)
+
+    def remove(self, progress):
+        with self.lock:
+            self.active.remove(progress)
+
+    def line(self):
+        # --- '' while nothing is being copied ---
+        with self.lock:
+            active = list(self.active)
+        if not active:
+            return ''
+        done = sum(progress.done for progress in active)
+        total = sum(progress.total for progress in active)
+        rate = sum(progress.rate() for progress in active)
+        return f"Copying {len(active)} book(s): {done / 1048576:,.0f} / {total / 1048576:,.0f} MB ({rate / 1048576:,.1f} MB/s)"
+
+
+def copy_book(source, destination, log, workers=4, move=False, show_progress=True, link=None, link_fallback=None, board=None):
+    # ----- Copy (or copy-move, or link) a book folder, files are copied in parallel -----
+    # - 'board' is a ProgressBoard the copy is added to while it runs, for books copied in parallel -
+
+    # - Mirror the folder structure and list the files, links are recreated as links and never followed -
+    files = []
+    links = []
+    for root, dirs, names in os.walk(source):
+        relative = os.path.relpath(root, source)
+        os.makedirs(os.path.join(destination, relative), exist_ok=True)
+        for name in dirs + names:
+            path = os.path.join(root, name)
+            target = os.path.normpath(os.path.join(destination, relative, name))
+            if os.path.islink(path):
+                links.append((path, target))
+            elif name in names:
+                files.append((path, target, os.path.getsize(path)))
+    files.sort(key=lambda file: file[2], reverse=True)  # Largest first, keeps the workers evenly loaded
+
+    progress = Progress(sum(file[2] for file in files))
+
+    def worker(path, target, size):
+        # --- Returns the method used for the file, counted once every worker is done ---
+        if link:
+            method = link_file(path, target, link, link_fallback)
+            progress.add(size)
+            return method
+        copy_file(path, target, progress)
+        if move:
+            # - Remove each source as soon as its copy is verified -
+            if os.path.getsize(target) != size:
+                raise OSError(f"Copy size mismatch: {target}")
+            os.remove(path)
+        return 'copy'
+
+    if board is not None:
+        board.add(progress)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(worker, *file) for file in files]
+            pending = futures
+            while pending:
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_EXCEPTION)
+                if show_progress:
+                    print(f"\r{progress.line()}          ", end='')
+                    sys.stdout.flush()
+                for future in done:
+                    if future.exception() is not None:
+                        for remaining in pending:
+                            remaining.cancel()
+                        raise future.exception()
+    finally:
+        if board is not None:
+            board.remove(progress)
+    if show_progress:
+        print()
+    for path, target in links:
+        if os.path.lexists(target):
+            os.remove(target)
+        os.symlink(os.readlink(path), target)
+        if move:
+            os.unlink(path)  # The link itself, whatever it points to is left alone
+    log.info(f"Copied {source} -> {destination}: {progress.line()}")
+    if link:
+        methods = {}
+        for future in futures:
+            methods[future.result()] = methods.get(future.result(), 0) + 1
+        log.info(f"Linked files by method: {methods}")
+        if methods.get('copy'):
+            print(f" - Warning: {methods['copy']} file(s) couldn't be linked and were copied instead")
+
+    # - Emptied source folders are removed bottom-up -
+    if move:
+        for root, dirs, names in os.walk(source, topdown=False):
+            try:
+                os.rmdir(root)
+            except OSError as e:
+                log.info(f"Couldn't remove source folder after copy-move ({root}) | {e}")
+
+    return progress.done
@@ -0,0 +1,106 @@
+# --- [--scan] Find the book folders in a library tree, streamed to the queue while the walk continues ---
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from tags import is_audio
+
+# --- Subfolders that are part of the book above them: 'CD1', 'Disc 02', 'Disk 3 of 4', 'Part 1' ---
+disc_folder = re.compile(r"^(?:cd|dis[ck]|part|pt)\W*\d+\b", re.I)
+
+
+def has_audio(path):
+    # --- Audio files directly inside path ---
+    try:
+        with os.scandir(path) as entries:
+            return any(entry.is_file() and is_audio(entry.name) for entry in entries)
+    except OSError:
+        return False
+
+
+def classify(path, skip):
+    # --- (True, []) for a book folder, (False, subfolders to walk) for anything else ---
+    files = False
+    discs = []
+    folders = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name.startswith('.') or entry.path in skip or entry.name in skip:
+                    continue
+                folders.append(entry.path)
+                if disc_folder.match(entry.name):
+                    discs.append(entry.path)
+            elif not files and is_audio(entry.name):
+                files = True
+    if files or any(has_audio(disc) for disc in discs):  # Disc subfolders roll up into this folder
+        return True, []
+    return False, folders
+
+
+class LibraryScan:
+    # ----- Parallel scandir walk of a library root, iterating yields book folders as the workers find them -----
+
+    def __init__(self, root, log, workers=8, skip=()):
+        self.root = Path(root).resolve()
+        self.log = log
+        self.skip = set(str(path) for path in skip)  # Folder names or full paths left out of the walk (outputs)
+        self.found = queue.Queue()
+        self.watchers = []
+        self.books = []
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def start(self):
+        self.walk(str(self.root))
+        return self
+
+    def walk(self, path):
+        with self.lock:
+            self.pending += 1
+        self.executor.submit(self.visit, path)
+
+    def visit(self, path):
+        try:
+            book, folders = classify(path, self.skip)
+        except OSError as exc:
+            self.log.info(f"Scan: couldn't read {path} | {exc}")
+            book, folders = False, []
+        if book:
+            self.add(Path(path))
+        for folder in sorted(folders):
+            self.walk(folder)
+        with self.lock:
+            self.pending -= 1
+            finished = self.pending == 0
+        if finished:
+            self.found.put(None)
+            self.executor.shutdown(wait=False)
+
+    def add(self, book):
+        self.log.debug(f"Scan: found book {book}")
+        with self.lock:
+            self.books.append(book)
+            watchers = list(self.watchers)
+        for callback in watchers:
+            callback(book)
+        self.found.put(book)
+
+    def watch(self, callback):
+        # --- Call 'callback' with every book found so far and from now on (from the worker threads) ---
+        with self.lock:
+            self.watchers.append(callback)
+            books = list(self.books)
+        for book in books:
+            callback(book)
+
+    def __iter__(self):
+        while True:
+            book = self.found.get()
+            if book is None:
+                return
+            yield book
@@ -0,0 +1,405 @@
+# --- Metadata fetch stage, resolves queued urls concurrently ahead of the processing loop ---
+import heapq
+import io
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from pathlib import Path
+
+from scrapers import http_request, api_audible, scrape_goodreads_type1, scrape_goodreads_type2
+from scrapers import goodreads_fast_parse
+from scrapers import audible_products, audible_products_url, audible_response_groups, audible_batch_size
+from scrapers import RetryLater, HostUnavailable
+from urls import audible_asin
+from profiler import profiler
+
+retry_backoff = 2.0  # Seconds before the first retry, doubled for each one after
+retry_backoff_max = 60.0
+retry_deadline = 600.0  # Seconds after its first failure that a book is given up on, however many attempts it had
+prefetch_delay = 5.0  # Seconds a prefetched Audible url waits for others to share its request, the queue isn't needed before then
+
+
+class ThreadOutput:
+    # --- Stand-in for sys.stdout, print() calls from worker threads are buffered per book ---
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def capture(self):
+        self.local.buffer = io.StringIO()
+
+    def release(self):
+        buffer = getattr(self.local, 'buffer', None)
+        self.local.buffer = None
+        return buffer.getvalue() if buffer is not None else ''
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def new_metadata(folder, url):
+    # --- Blank metadata for a queued book ---
+    return {
+        'author': '',
+        'authors_multi': '',
+        'title': '',
+        'summary': '',
+        'subtitle': '',
+        'narrator': '',
+        'publisher': '',
+        'publishyear': '',
+        'genres': '',
+        'isbn': '',
+        'asin': '',
+        'series': '',
+        'sereis_multi': '',
+        'volumenumber': '',
+        'url': url,
+        'skip': False,
+        'failed': False,
+        'failed_exception': '',
+        'input_folder': str(Path(folder).resolve().name)
+    }
+
+
+debug_page_lock = threading.Lock()
+
+
+def fetch_metadata(folder, url, log, debug_page=False, cache=None, products=None, mirror=None):
+    # ----- Request and scrape the metadata for a single book -----
+
+    metadata = new_metadata(folder, url)
+
+    # --- Warm cache skips both the request and the parse ---
+    if cache is not None:
+        cached = cache.get(url)
+        if cached is not None:
+            log.info(f"Metadata cache hit: {url}")
+            metadata.update(cached)
+            return metadata
+
+    while True:
+
+        if 'audible.com' in metadata['url']:
+            # --- ASIN ---
+            metadata['asin'] = audible_asin.search(metadata['url'])[1]
+
+            # - Product from the local mirror or a batched request, missing ASINs fall back to a single request -
+            page = mirror.product(metadata['asin']) if mirror is not None else None
+            if page is None and products is not None:
+                page = products.result().get(metadata['asin'])
+            if page is None:
+                query = {'response_groups': audible_response_groups}
+                metadata, response = http_request(metadata, log, f"{audible_products_url}/{metadata['asin']}", query)
+                if metadata['skip'] is True:
+                    break
+                page = response.json()['product']
+            with profiler.span('scrape', metadata['input_folder'], site='audible'):
+                metadata = api_audible(metadata, page, log)
+            break
+
+        elif 'goodreads.com' in metadata['url']:
+            metadata, response = http_request(metadata, log)
+
+            if debug_page:
+                with debug_page_lock, Path(debug_page).open('w', encoding='utf-8') as html_page:
+                    html_page.write(response.text)
+
+            if metadata['skip'] is True:
+                break
+            with profiler.span('scrape', metadata['input_folder'], site='goodreads') as span:
+                parsed = goodreads_fast_parse(response.text)
+                span.set(fast_path=parsed is not None)
+                if parsed is not None:
+                    metadata = scrape_goodreads_type2(parsed, metadata, log)
+                    break
+                from bs4 import BeautifulSoup  # Only old layout pages need the full parse
+                parsed = BeautifulSoup(response.text, 'html.parser')
+                if parsed.select_one('#bookTitle') is not None:
+                    metadata = scrape_goodreads_type1(parsed, metadata, log)
+                    break
+                elif parsed.select_one("script[type='application/ld+json']") is not None:
+                    metadata = scrape_goodreads_type2(parsed, metadata, log)
+                    break
+
+    # --- Titles that fell back to the folder name are specific to this run, don't keep them ---
+    if cache is not None and metadata['skip'] is False and metadata['title'] != metadata['input_folder']:
+        cache.put(url, metadata)
+
+    return metadata
+
+
+def run_captured(function, *args):
+    # --- Run in a pool thread while a Fetcher is open, returns (result, everything it printed) ---
+    sys.stdout.capture()
+    try:
+        result = function(*args)
+    finally:
+        output = sys.stdout.release()
+    return result, output
+
+
+def batch_worker(asins, log):
+    # --- Runs in the pool, books fall back to their own request on failure so output only goes to the log ---
+    sys.stdout.capture()
+    try:
+        return audible_products(asins, log)
+    finally:
+        output = sys.stdout.release()
+        if output:
+            log.info(f"Audible batch output: {output}")
+
+
+def fetch_worker(folder, url, log, debug_page, cache, products, mirror=None):
+    # --- Runs in the pool, returns the metadata with everything the scrape printed ---
+    sys.stdout.capture()
+    try:
+        metadata = fetch_metadata(folder, url, log, debug_page, cache, products, mirror)
+    except RetryLater as exc:  # Transient, the Fetcher schedules another attempt
+        metadata = exc
+    except Exception as exc:
+        log.error(f"Metadata fetch error ({folder}): {exc}")
+        metadata = new_metadata(folder, url)
+        metadata['skip'] = True
+        metadata['failed'] = True
+        metadata['failed_exception'] = f"{metadata['input_folder']}: Metadata fetch error: {exc}"
+        print(f"Failed to fetch metadata, skipping {metadata['input_folder']}...")
+    return metadata, sys.stdout.release()
+
+
+class RetryScheduler:
+    # --- One timer thread for every deferred call, later() returns a future for the call's own future result ---
+
+    def __init__(self):
+        self.heap = []
+        self.count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def later(self, delay, submit):
+        # --- Call submit() after delay seconds, it returns a future whose result is passed on ---
+        future = Future()
+        with self.condition:
+            self.count += 1
+            heapq.heappush(self.heap, (time.monotonic() + delay, self.count, submit, future))
+            self.condition.notify()
+        return future
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                if self.closed:
+                    return
+                due, count, submit, future = heapq.heappop(self.heap)
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                submit().add_done_callback(lambda done, future=future: pass_on(done, future))
+            except Exception as exc:
+                future.set_exception(exc)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            for due, count, submit, future in self.heap:
+                future.cancel()
+            self.heap = []
+            self.condition.notify()
+
+
+def pass_on(done, future):
+    # --- Copy a finished future's outcome to another ---
+    if done.cancelled():
+        future.set_exception(RuntimeError('Retry cancelled'))
+    elif done.exception() is not None:
+        future.set_exception(done.exception())
+    else:
+        future.set_result(done.result())
+
+
+class Fetcher:
+    # ----- Metadata worker pool, books can be prefetched while the queue is still being built -----
+
+    def __init__(self, log, workers=4, debug_page=False, cache=None, mirror=None, retries=5):
+        self.log = log
+        self.debug_page = debug_page
+        self.cache = cache
+        self.mirror = mirror
+        self.retries = retries
+        self.futures = {}  # (folder, url): future
+        self.attempts = {}  # (folder, url): [failed attempts, time of the first failure, output so far] of deferred books
+        self.batch = None  # [(folder, url, asin, placeholder future)] of prefetched books waiting to share a request
+        self.lock = threading.Lock()
+        self.scheduler = RetryScheduler()
+        self.stdout = sys.stdout
+        sys.stdout = ThreadOutput(self.stdout)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def prefetch(self, folder, url, product=None):
+        # --- Start fetching a book as soon as its url is known, 'product' skips the request for Audible books ---
+        # - Other Audible urls are held for up to prefetch_delay, the ASINs copied meanwhile go out as one request -
+        key = (str(Path(folder).resolve()), url)
+        if key in self.futures:
+            return
+        self.log.debug(f"Prefetching metadata: {url}")
+        products = None
+        if product is not None:
+            products = Future()
+            products.set_result({product['asin']: product})
+        elif self.batchable(url):
+            placeholder = Future()
+            with self.lock:
+                if self.batch is None:
+                    self.batch = []
+                    batch = self.batch
+                    self.scheduler.later(prefetch_delay, lambda: self.flush(batch))
+                self.batch.append((folder, url, audible_asin.search(url)[1], placeholder))
+                full = len(self.batch) >= audible_batch_size
+            self.futures[key] = placeholder
+            if full:
+                self.flush()
+            return
+        self.futures[key] = self.executor.submit(fetch_worker, folder, url, self.log, self.debug_page, self.cache, products, self.mirror)
+
+    def batchable(self, url):
+        # --- An Audible url that isn't cached or mirrored, so it needs a request ---
+        match = audible_asin.search(url)
+        return bool(match) and not (self.cache is not None and self.cache.peek(url)) and not (self.mirror is not None and self.mirror.contains(match[1]))
+
+    def flush(self, batch=None):
+        # --- Send the waiting prefetched ASINs as one request, 'batch' (from the timer) only if it's still waiting ---
+        with self.lock:
+            if self.batch is None or (batch is not None and batch is not self.batch):
+                done = Future()
+                done.set_result(None)
+                return done
+            books, self.batch = self.batch, None
+        products = self.executor.submit(batch_worker, list(dict.fromkeys(asin for _, _, asin, _ in books)), self.log)  # Submitted before the books waiting on it
+        for folder, url, asin, placeholder in books:
+            future = self.executor.submit(fetch_worker, folder, url, self.log, self.debug_page, self.cache, products, self.mirror)
+            future.add_done_callback(lambda done, placeholder=placeholder: pass_on(done, placeholder))
+        return products
+
+    def submit(self, books):
+        # --- Submit books that weren't prefetched, their uncached Audible ASINs are requested in chunks ---
+
+        pending = []
+        for folder, url, metadata in books:
+            key = (str(Path(folder).resolve()), url)
+            if key in self.futures:
+                continue
+            if metadata is not None:  # Already scraped in an earlier run (journal)
+                self.futures[key] = Future()
+                self.futures[key].set_result((metadata, ''))
+                continue
+            pending.append((folder, url))
+
+        batches = {}
+        asins = {}
+        for folder, url in pending:
+            if self.batchable(url):
+                asins[audible_asin.search(url)[1]] = True
+        asins = list(asins)
+        for start in range(0, len(asins), audible_batch_size):
+            chunk = asins[start:start + audible_batch_size]
+            future = self.executor.submit(batch_worker, chunk, self.log)  # Submitted before the books waiting on it, the pool starts it first
+            for asin in chunk:
+                batches[asin] = future
+
+        for folder, url in pending:
+            match = audible_asin.search(url)
+            products = batches.get(match[1]) if match else None
+            self.futures[(str(Path(folder).resolve()), url)] = self.executor.submit(fetch_worker, folder, url, self.log, self.debug_page, self.cache, products, self.mirror)
+
+    def retry(self, folder, url, key, exc, output):
+        # --- Schedule another attempt after a transient failure, returns (metadata, output) once the budget is spent ---
+
+        attempts, first, earlier = self.attempts.get(key, [0, time.monotonic(), ''])
+        if not isinstance(exc, HostUnavailable):  # Waiting out a paused host isn't an attempt
+            attempts += 1
+        earlier += output
+        name = Path(folder).name
+        if attempts > self.retries or time.monotonic() - first > retry_deadline:
+            self.log.error(f"Giving up on {url} after {attempts} attempts: {exc.reason}")
+            self.attempts.pop(key, None)
+            metadata = new_metadata(folder, url)
+            metadata['skip'] = True
+            metadata['failed'] = True
+            metadata['failed_exception'] = f"{metadata['input_folder']}: {exc.reason} (gave up after {attempts} attempts)"
+            return metadata, f"{earlier}Failed to get webpage page, skipping {metadata['input_folder']}...\n"
+
+        delay = exc.delay if exc.delay is not None else min(retry_backoff_max, retry_backoff * 2 ** max(0, attempts - 1))
+        self.log.info(f"Retrying {url} in {delay:.1f}s ({exc.reason}), attempt {attempts} of {self.retries}")
+        if not isinstance(exc, HostUnavailable):
+            earlier += f"\nBad response from webpage ({exc.reason}), retrying {name} in {delay:.0f} seconds...\n"
+        self.attempts[key] = [attempts, first, earlier]
+        self.futures[key] = self.scheduler.later(delay, lambda: self.executor.submit(fetch_worker, folder, url, self.log, self.debug_page, self.cache, None, self.mirror))
+        return None
+
+    def waiting(self, book):
+        # --- True for a deferred book whose next attempt hasn't finished ---
+        key = (str(Path(book[0]).resolve()), book[1])
+        return key in self.attempts and not self.futures[key].done()
+
+    def results(self, queue, window=200):
+        # --- Yield (folder, metadata, output) for every (folder, url, metadata) in the queue, in queue order ---
+        # - The queue is streamed, only 'window' books are submitted ahead of the one being processed -
+        # - A book that failed transiently goes to the back while its retry waits, the others carry on -
+
+        self.flush()  # The queue is complete, prefetched books stop waiting for company
+        queue = iter(queue)
+        ahead = deque()
+
+        def fill():
+            books = list(islice(queue, window - len(ahead)))
+            self.submit(books)
+            ahead.extend(books)
+
+        fill()
+        while ahead:
+            index = next((index for index, book in enumerate(ahead) if not self.waiting(book)), None)
+            if index is None:  # Every book left is waiting on a retry
+                wait([self.futures[(str(Path(folder).resolve()), url)] for folder, url, _ in ahead], return_when=FIRST_COMPLETED)
+                continue
+            folder, url, _ = book = ahead[index]
+            del ahead[index]
+            key = (str(Path(folder).resolve()), url)
+            metadata, output = self.futures[key].result()
+            if isinstance(metadata, RetryLater):
+                deferred = self.retry(folder, url, key, metadata, output)
+                if deferred is None:
+                    ahead.append(book)
+                    continue
+                metadata, output = deferred
+            elif key in self.attempts:
+                output = self.attempts.pop(key)[2] + output
+            del self.futures[key]
+            yield folder, metadata, output
+            if len(ahead) < window // 2:
+                fill()
+
+    def close(self):
+        with self.lock:
+            self.batch = None
+        self.scheduler.close()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        sys.stdout = self.stdout
+
@@ -0,0 +1,97 @@
+# --- Append-only processing journal (queue.jsonl), records every finished stage so a run can be resumed ---
+import json
+import os
+import threading
+from pathlib import Path
+
+stages = ['scrape', 'move', 'flatten', 'rename', 'opf', 'info', 'abs', 'json']
+
+
+class Journal:
+    # ----- One JSON event per line: {'folder': ..., 'event': 'queued'/<stage>/'complete', ...} -----
+
+    def __init__(self, path, log, resume=False):
+        self.path = Path(path)
+        self.log = log
+        self.lock = threading.Lock()
+        self.known = set()  # Folders already queued
+        if resume and self.path.exists():
+            for event in self.events():
+                if event['event'] == 'queued':
+                    self.known.add(event['folder'])
+            self.file = self.path.open('a', encoding='utf-8')
+        else:
+            self.file = self.path.open('w', encoding='utf-8')
+
+    def events(self, with_offsets=False):
+        # --- Stream the journal, a line cut short by a crash is ignored ---
+        with self.path.open('rb') as file:
+            while True:
+                offset = file.tell()
+                line = file.readline()
+                if not line:
+                    break
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    self.log.info(f"Skipping unreadable journal line at offset {offset}")
+                    continue
+                yield (offset, event) if with_offsets else event
+
+    def record(self, folder, event, **data):
+        # --- Append an event, flushed to disk before returning ---
+        entry = {'folder': str(folder), 'event': event}
+        entry.update(data)
+        with self.lock:
+            self.file.write(json.dumps(entry, default=str) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def queue(self, folder, url):
+        self.known.add(str(folder))
+        self.record(folder, 'queued', url=url)
+
+    def queued(self, folder):
+        return str(folder) in self.known
+
+    def books(self):
+        # ----- Yield (folder, url, metadata) for every unfinished book, in queue order -----
+        # - metadata is None unless the scrape finished in an earlier run, it then carries 'done_stages' -
+
+        # - First pass only keeps the url, finished stages and where the scraped metadata is -
+        books = {}
+        for offset, event in self.events(with_offsets=True):
+            folder = event['folder']
+            if event['event'] == 'queued':
+                books.pop(folder, None)  # Re-queued with a new url, starts over
+                books[folder] = {'url': event['url'], 'stages': [], 'scrape': None, 'final_output': None, 'complete': False}
+            elif folder not in books:
+                continue
+            elif event['event'] == 'complete':
+                books[folder]['complete'] = True
+            elif event['event'] in stages:
+                books[folder]['stages'].append(event['event'])
+                if event['event'] == 'scrape':
+                    books[folder]['scrape'] = offset
+                elif event['event'] == 'move':
+                    books[folder]['final_output'] = event.get('final_output')
+
+        # - Second pass reads the metadata back one book at a time -
+        with self.path.open('rb') as file:
+            for folder, book in books.items():
+                if book['complete']:
+                    self.log.info(f"Journal: already complete, skipping ({folder})")
+                    continue
+                metadata = None
+                if book['scrape'] is not None:
+                    file.seek(book['scrape'])
+                    metadata = json.loads(file.readline())['metadata']
+                    metadata['done_stages'] = book['stages']
+                    if book['final_output']:
+                        metadata['final_output'] = Path(book['final_output'])
+                    self.log.info(f"Journal: resuming after {book['stages']} ({folder})")
+                yield Path(folder), book['url'], metadata
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,64 @@
+# --- Library index, remembers tags and chosen urls for folders that haven't changed since the last run ---
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def fingerprint(folder):
+    # --- (file count, total size, newest mtime) from a stat walk, no file is opened ---
+    count = 0
+    size = 0
+    newest = 0
+    pending = [str(folder)]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            count += 1
+            size += stat.st_size
+            newest = max(newest, stat.st_mtime_ns)
+    return f"{count}:{size}:{newest}"
+
+
+class LibraryIndex:
+    # ----- SQLite map of folder path -> fingerprint, probed tags and the last url chosen for it -----
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, fingerprint TEXT, tags TEXT, url TEXT, updated REAL)")
+        self.db.commit()
+
+    def lookup(self, folder, current):
+        # --- Stored entry for an unchanged folder, None if it's new or has changed ---
+        with self.lock:
+            row = self.db.execute("SELECT fingerprint, tags, url FROM folders WHERE path = ?", (str(folder),)).fetchone()
+        if row is None or row[0] != current:
+            return None
+        return {'tags': json.loads(row[1]) if row[1] else None, 'url': row[2]}
+
+    def remember(self, folder, current, tags=None, url=None):
+        # --- Store tags and/or url, keeping the previous values for whatever isn't given ---
+        with self.lock:
+            row = self.db.execute("SELECT fingerprint, tags, url FROM folders WHERE path = ?", (str(folder),)).fetchone()
+            if row is not None and row[0] == current:
+                tags = tags if tags is not None else (json.loads(row[1]) if row[1] else None)
+                url = url if url is not None else row[2]
+            self.db.execute("INSERT OR REPLACE INTO folders (path, fingerprint, tags, url, updated) VALUES (?, ?, ?, ?, ?)",
+                            (str(folder), current, json.dumps(tags) if tags is not None else None, url, time.time()))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,121 @@
+# --- Look-ahead for the clipboard queue, the next books' searches are ready before the user gets to them ---
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from automatch import score, product_url
+
+# --- DuckDuckGo query prefix for each --site ---
+search_sites = {
+    'audible': 'site:audible.com',
+    'goodreads': 'site:goodreads.com',
+    'both': 'audible.com goodreads.com',
+}
+
+
+def search_page(site, search_term):
+    return f"https://duckduckgo.com/?t=ffab&q={search_sites[site]} {search_term}"
+
+
+class SearchLookahead:
+    # ----- Prepares the next 'window' books while the user works on the current one -----
+    # - Each book gets its tags and search page, [--lookahead-tabs] opens the page in a background tab and -
+    # - [--lookahead-matches] runs the Audible catalog search so the candidates can be listed straight away -
+
+    def __init__(self, prober, browser, log, window=4, site='both', tabs=False, matches=False, mirror=None, workers=2):
+        self.prober = prober
+        self.browser = browser
+        self.log = log
+        self.window = max(0, window)
+        self.site = site
+        self.tabs = tabs
+        self.matches = matches
+        self.mirror = mirror
+        self.events = []
+        self.stops = []  # (stop, room) of every reader, close() lets them go
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def books(self, folders):
+        # ----- Yield (folder, future of its prepared search) in order, up to 'window' folders are prepared ahead of the one yielded -----
+        # - 'folders' can be a stream ([--scan]), it's read in a thread so the first book is yielded as soon as its search is submitted -
+        submitted = queue.Queue()
+        room = threading.Semaphore(self.window + 1)  # The yielded book and the window after it
+        stop = threading.Event()
+        self.stops.append((stop, room))
+        reader = threading.Thread(target=self.read, args=(folders, submitted, room, stop), daemon=True)
+        reader.start()
+        try:
+            while True:
+                book = submitted.get()
+                if book is None:
+                    return
+                if isinstance(book, BaseException):
+                    raise book
+                yield book
+                room.release()  # The caller is done with it, the next folder can be read
+        finally:
+            stop.set()
+            room.release()
+
+    def read(self, folders, submitted, room, stop):
+        # --- Reader thread, submits each folder's search once there is room in the window ---
+        opened = None  # Set once the previous book's tab is open, background tabs keep the queue order
+        first = True
+        try:
+            for folder in folders:
+                room.acquire()
+                if stop.is_set():
+                    return
+                folder = folder.resolve()
+                tab = self.tabs and self.window > 0 and not first  # The first book's page is opened by the caller, in the foreground
+                previous, opened = opened, threading.Event()
+                self.events.append(opened)
+                submitted.put((folder, self.executor.submit(self.prepare, folder, tab, previous, opened)))
+                first = False
+        except BaseException as exc:
+            submitted.put(exc)
+        finally:
+            submitted.put(None)
+
+    def prepare(self, folder, tab=False, previous=None, opened=None):
+        # --- {'tags', 'page', 'tab', 'matches'}, 'page' is the search (or the page matched last time) ---
+        try:
+            tags = self.prober.probe(folder)
+            page = tags['url'] or search_page(self.site, tags['search_term'])
+            if tab:
+                if previous is not None:
+                    previous.wait()
+                self.browser.open(page, background=True)
+        finally:
+            if opened is not None:
+                opened.set()
+        return {'tags': tags, 'page': page, 'tab': tab, 'matches': self.candidates(folder, tags)}
+
+    def candidates(self, folder, tags, limit=5):
+        # ----- Numbered choices for the terminal, local mirror matches first then the catalog search -----
+
+        found = []
+        try:
+            if self.mirror is not None:
+                found = [dict(match, source='local') for match in self.mirror.search(tags['title'] or tags['search_term'], tags['author'], limit=limit)]
+            if self.matches and tags['title']:
+                from scrapers import audible_search
+                from fetch import run_captured
+                products, output = run_captured(audible_search, tags['title'], tags['author'], self.log, folder.name)
+                if output:
+                    self.log.info(f"Look-ahead search ({folder.name}): {output.strip()}")
+                known = {match['product']['asin'] for match in found}
+                ranked = sorted(((score(product, tags), product) for product in products if product.get('asin') and product['asin'] not in known),
+                                key=lambda pair: pair[0], reverse=True)
+                found += [{'score': value, 'product': product, 'url': product_url(product), 'source': 'search'} for value, product in ranked[:limit]]
+        except Exception as exc:
+            self.log.error(f"Look-ahead candidates error ({folder}): {exc}")
+        return found
+
+    def close(self):
+        for stop, room in self.stops:  # A reader waiting for room in the window stops
+            stop.set()
+            room.release()
+        for event in self.events:  # A book still waiting on a cancelled one's tab is let go
+            event.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,83 @@
+# --- Local metadata mirror, Audible product records searchable by title/author without the network ---
+import json
+import sqlite3
+import threading
+
+from automatch import normalise, score, product_url
+
+stopwords = {'a', 'an', 'and', 'by', 'of', 'the', 'to', 'in', 'on'}  # Too common to narrow a search
+
+
+def record_words(product):
+    # --- Normalised words of the title, subtitle and author names ---
+    text = ' '.join([product.get('title') or '', product.get('subtitle') or ''] + [author.get('name', '') for author in product.get('authors') or []])
+    return set(normalise(text).split())
+
+
+class MetadataMirror:
+    # ----- SQLite store of product records (ASIN primary key) with an inverted word index -----
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS products (asin TEXT PRIMARY KEY, data TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS words (word TEXT, asin TEXT, PRIMARY KEY (word, asin)) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS words_asin ON words (asin)")  # Re-imported records drop their old words
+        self.db.commit()
+
+    def import_jsonl(self, path, log, batch=5000):
+        # --- Load a dump of product records, one per line (bare or wrapped in {'product': ...}), returns the count ---
+        count = 0
+        rows = []
+        with open(path, 'r', encoding='utf-8') as file:
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    product = json.loads(line)
+                    product = product.get('product', product)
+                    rows.append((product['asin'], product))
+                except (ValueError, KeyError, AttributeError) as e:
+                    log.info(f"Skipping unreadable mirror record on line {number} | {e}")
+                    continue
+                if len(rows) >= batch:
+                    count += self.store(rows)
+                    rows = []
+        count += self.store(rows)
+        return count
+
+    def store(self, rows):
+        with self.lock:
+            self.db.executemany("DELETE FROM words WHERE asin = ?", [(asin,) for asin, product in rows])
+            self.db.executemany("INSERT OR REPLACE INTO products (asin, data) VALUES (?, ?)", [(asin, json.dumps(product)) for asin, product in rows])
+            self.db.executemany("INSERT OR IGNORE INTO words (word, asin) VALUES (?, ?)", [(word, asin) for asin, product in rows for word in record_words(product)])
+            self.db.commit()
+        return len(rows)
+
+    def product(self, asin):
+        # --- The stored record for an ASIN, None if it isn't mirrored ---
+        with self.lock:
+            row = self.db.execute("SELECT data FROM products WHERE asin = ?", (asin,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def contains(self, asin):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM products WHERE asin = ?", (asin,)).fetchone() is not None
+
+    def search(self, title, author=False, limit=5, candidates=50):
+        # ----- Products sharing the most words with title/author, ranked by the --auto score -----
+        words = set(normalise(f"{title} {author or ''}").split())
+        words = sorted(words - stopwords or words)
+        if not words:
+            return []
+        marks = ','.join('?' * len(words))
+        with self.lock:
+            rows = self.db.execute(f"SELECT p.data FROM (SELECT asin, COUNT(*) AS hits FROM words WHERE word IN ({marks}) GROUP BY asin ORDER BY hits DESC LIMIT ?) AS w "
+                                   f"JOIN products AS p ON p.asin = w.asin", (*words, candidates)).fetchall()
+        tags = {'title': title, 'author': author}
+        ranked = sorted(((score(product, tags), product) for product in (json.loads(row[0]) for row in rows)), key=lambda pair: pair[0], reverse=True)
+        return [{'score': value, 'product': product, 'url': product_url(product)} for value, product in ranked[:limit]]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,133 +1,138 @@
 # --- Optional functions specified by flags ---
+import os
 import re
 import shutil
+from pathlib import Path
+
+from sidecars import atomic_write, render, sidecar_names
+from tags import is_audio
 
 
 def create_opf(metadata, opf_template):
     # --- Generate .opf Metadata file ---
+    atomic_write(metadata['final_output'] / sidecar_names['opf'], render('opf', metadata, opf_template))
 
-    with opf_template.open('r') as file:
-        template = file.read()
-
-    # - Author -
-    if metadata['author'] == '__unknown__':
-        template = re.sub(r"__AUTHOR__", '', template)
-    else:
-        template = re.sub(r"__AUTHOR__", metadata['author'], template)
 
-    # - Title -
-    if metadata['title'] == metadata['input_folder']:
-        template = re.sub(r"__TITLE__", '', template)
-    else:
-        template = re.sub(r"__TITLE__", metadata['title'], template)
-
-    # - Summary -
-    template = re.sub(r"__SUMMARY__", metadata['summary'], template)
+def create_info(metadata):
+    # --- Generate info.txt summary file ---
+    atomic_write(metadata['final_output'] / sidecar_names['info'], render('info', metadata))
 
-    # - Subtitle -
-    template = re.sub(r"__SUBTITLE__", metadata['subtitle'], template)
 
-    # - Narrator -
-    template = re.sub(r"__NARRATOR__", metadata['narrator'], template)
+def scan_book(book_path):
+    # --- One os.scandir walk, returns (sorted audio files, every file path) ---
+    audio_files = []
+    existing = set()
+    folders = [str(book_path)]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                    continue
+                path = Path(entry.path)
+                existing.add(path)
+                if is_audio(entry.name):
+                    audio_files.append(path)
+    audio_files.sort()
+    return audio_files, existing
 
-    # - Publisher -
-    template = re.sub(r"__PUBLISHER__", metadata['publisher'], template)
 
-    # - Publish Year -
-    template = re.sub(r"__PUBLISHYEAR__", metadata['publishyear'], template)
+def track_name(track, count, clean_title, suffix):
+    padding = 3 if count >= 100 else 2
+    return f"{str(track).zfill(padding)} - {clean_title}{suffix}"
 
-    # - Genres -
-    template = re.sub(r"__GENRES__", metadata['genres'], template)
 
-    # - ISBN -
-    template = re.sub(r"__ISBN__", metadata['isbn'], template)
+def plan_tracks(book_path, title, log, flatten=False, rename=False):
+    # ----- Plan [--flatten] and [--rename] together, returns ([(source, destination)], folders to remove) -----
 
-    # - ASIN -
-    template = re.sub(r"__ASIN__", metadata['asin'], template)
+    book_path = Path(book_path)
+    audio_files, existing = scan_book(book_path)
+    log.debug(f"Scanned audio files for planning = {str(audio_files)}")
+    clean_title = re.sub(r"[^\w\-\.\(\) ]+", '', title)
+    planned = {file: file for file in audio_files}
 
-    # - Series -
-    template = re.sub(r"__SERIES__", metadata['series'], template)
+    # - Flatten: nested tracks move to the root as '## - {title}', numbered in path order -
+    nested = [file for file in audio_files if file.parent != book_path]
+    if flatten:
+        for track, file in enumerate(nested, 1):
+            planned[file] = book_path / track_name(track, len(nested), clean_title, file.suffix)
 
-    # - Volume Number -
-    template = re.sub(r"__VOLUMENUMBER__", metadata['volumenumber'], template)
+    # - Rename: every track, numbered in the order of where the flatten left it -
+    if rename:
+        ordered = sorted(audio_files, key=lambda file: planned[file])
+        for track, file in enumerate(ordered, 1):
+            planned[file] = planned[file].parent / track_name(track, len(ordered), clean_title, file.suffix)
 
-    opf_output = metadata['final_output'] / 'metadata.opf'
-    with opf_output.open('w', encoding='utf-8') as file:
-        file.write(template)
+    # - Collisions: a destination can't be a file that stays, or another track's destination -
+    moving = {file for file in audio_files if planned[file] != file}
+    taken = existing - moving
+    moves = []
+    for file in audio_files:
+        if file not in moving:
+            continue
+        destination = planned[file]
+        copy = 2
+        while destination in taken:
+            destination = planned[file].with_name(f"{planned[file].stem} ({copy}){planned[file].suffix}")
+            copy += 1
+        if destination != planned[file]:
+            log.info(f"Name collision, {planned[file].name} planned as {destination.name}")
+        taken.add(destination)
+        moves.append((file, destination))
+
+    # - Folders emptied of their tracks by the flatten -
+    folders = {file.parent for file in nested} if flatten else set()
+    folders = sorted(folder for folder in folders if not folders.intersection(folder.parents))
+    return moves, folders
+
+
+def apply_plan(plan, book_path, log):
+    # ----- Apply a plan_tracks() plan in one batch -----
+
+    moves, folders = plan
+    sources = {source for source, destination in moves}
+
+    # - A destination that is still another track's name goes through a temporary name first -
+    staged = []
+    for number, (source, destination) in enumerate(moves):
+        if destination in sources:
+            temporary = destination.with_name(f"{destination.stem}.{number}.partial{destination.suffix}")
+            os.rename(source, temporary)
+            staged.append((temporary, destination))
+        else:
+            os.rename(source, destination)
+        log.debug(f"{source} --> {destination}")
+    for temporary, destination in staged:
+        os.rename(temporary, destination)
+
+    # - Delete old folders, then any parents they leave empty -
+    book_path = Path(book_path)
+    for folder in folders:
+        shutil.rmtree(folder, ignore_errors=True)
+        for parent in folder.parents:
+            if parent == book_path or book_path not in parent.parents:
+                break
+            try:
+                parent.rmdir()
+            except OSError:
+                break
 
     return
 
 
-def create_info(metadata):
-    # --- Generate info.txt summary file ---
-    txt_file = metadata['final_output'] / 'info.txt'
-    with txt_file.open('w', encoding='utf-8') as file:
-        file.write(metadata['summary'])
+def describe_plan(plan, book_path, output):
+    # --- [--dry-run] Lines listing a plan made on book_path as it would apply to output ---
+    moves, folders = plan
+    lines = [f"  {source.relative_to(book_path)} --> {Path(output) / destination.relative_to(book_path)}" for source, destination in moves]
+    lines.extend(f"  Remove: {Path(output) / folder.relative_to(book_path)}" for folder in folders)
+    return lines
 
 
 def flatten_folder(metadata, log):
     # --- Flatten folder and rename audio files to avoid conflicts ---
-
-    # - Get all audio files -
-    audio_ext = ['mp3', 'm4b', 'm4a', 'ogg']
-    audio_files = []
-    for extension in audio_ext:
-        results = sorted(metadata['final_output'].rglob(f"./*.{extension}"))
-        for result in results:
-            if result.parent != metadata['final_output']:
-                audio_files.append(result)
-
-    # - Sort files for renaming
-    audio_files.sort()
-    log.debug(f"Globbed audio files for flattening = {str(audio_files)}")
-
-    # - Move all audio files to root of book folder -
-    track = 1
-    padding = 2
-    if len(audio_files) >= 100:
-        padding = 3
-
-    for file in audio_files:
-        clean_title = re.sub(r"[^\w\-\.\(\) ]+", '', metadata['title'])
-        file.rename(metadata['final_output'] / f"{str(track).zfill(padding)} - {clean_title}{file.suffix}")
-        log.debug(metadata['final_output'] / f"{str(track).zfill(padding)} - {clean_title}{file.suffix}")
-        track += 1
-
-    # - Delete old folders -
-    for file in audio_files:
-        if file.parent != metadata['final_output']:
-            shutil.rmtree(file.parent, ignore_errors=True)
-
-    return
+    apply_plan(plan_tracks(metadata['final_output'], metadata['title'], log, flatten=True), metadata['final_output'], log)
 
 
 def rename_tracks(metadata, log):
     # --- Rename audio tracks to '## - {title}' format ---
-
-    # - Get all audio files -
-    audio_ext = ['mp3', 'm4b', 'm4a', 'ogg']
-    audio_files = []
-    for extension in audio_ext:
-        results = sorted(metadata['final_output'].rglob(f"./*.{extension}"))
-        for result in results:
-            audio_files.append(result)
-
-    # - Sort files for renaming
-    audio_files.sort()
-    log.debug(f"Globbed audio files for renaming = {str(audio_files)}")
-
-    # - Rename to '## - {title}.{extension}' in current folder
-    track = 1
-    padding = 2
-    if len(audio_files) < 1:
-        return
-    elif len(audio_files) >= 100:
-        padding = 3
-
-    for file in audio_files:
-        clean_title = re.sub(r"[^\w\-\.\(\) ]+", '', metadata['title'])
-        file.rename(file.parent / f"{str(track).zfill(padding)} - {clean_title}{file.suffix}")
-        log.debug(metadata['final_output'] / f"{str(track).zfill(padding)} - {clean_title}{file.suffix}")
-        track += 1
-
-    return
+    apply_plan(plan_tracks(metadata['final_output'], metadata['title'], log, rename=True), metadata['final_output'], log)
@@ -0,0 +1,453 @@
+# --- The organizing pipeline as an importable API, BadaBoomBooks.py is the command-line wrapper around it ---
+import functools
+import logging
+import re
+from collections import deque
+from pathlib import Path
+from types import SimpleNamespace
+
+from optional import plan_tracks, apply_plan, describe_plan
+from sidecars import SidecarWriter, render, sidecar_names
+from postprocess import PostProcessor
+from discover import LibraryScan
+from fetch import Fetcher
+from scrapers import configure_client, default_client
+from cache import MetadataCache
+from clipboard import ClipboardWatcher, PyperclipBackend, LineChannel
+from tags import TagProber
+from library import LibraryIndex
+from copier import copy_book
+from journal import Journal
+from profiler import profiler
+from automatch import auto_match
+from mirror import MetadataMirror
+from analysis import AudioAnalyser
+from browser import WebBrowserBackend
+from lookahead import SearchLookahead
+import urls
+
+root_path = Path(__file__).resolve().parent
+default_output = '_BadaBoomBooks_'  # In the same directory as the input folder
+
+# --- Every option and its default, the command-line flags share these ---
+defaults = {
+    'data_dir': root_path,  # Journal, metadata cache, library index and mirror
+    'input': 'clipboard',
+    'output': None,
+    'auto': False,
+    'auto_threshold': 0.85,
+    'abs_json': False,
+    'analyze': False,
+    'analyze_workers': None,  # CPU count
+    'book_workers': 4,
+    'copy': False,
+    'link': None,
+    'link_fallback': None,
+    'lookahead': 4,
+    'lookahead_tabs': False,
+    'lookahead_matches': False,
+    'copy_workers': 4,
+    'device_limit': 2,
+    'debug': False,
+    'dry_run': False,
+    'flatten': False,
+    'infotxt': False,
+    'json': False,
+    'opf': False,
+    'rename': False,
+    'refresh': False,
+    'site': 'both',
+    'workers': 4,
+    'rate': None,
+    'retries': 5,
+    'connections': 4,
+    'timeout': None,  # scrapers.request_timeout
+    'transport': None,  # requests adapter for every request (eg: a stub server's), replaces the shared http client
+}
+
+
+def settings(options=None, **overrides):
+    # --- Defaults updated from a dict or argparse namespace, then keyword overrides ---
+    if options is not None and not isinstance(options, dict):
+        options = vars(options)
+    merged = dict(defaults)
+    merged.update(options or {})
+    merged.update(overrides)
+    merged['data_dir'] = Path(merged['data_dir'])
+    return SimpleNamespace(**merged)
+
+
+class Organizer:
+    # ----- Long-lived state (http client, metadata cache, mirror, clipboard) shared by every organize() call -----
+    # - organize() returns one result per book: {'folder', 'status', 'summary', 'output', 'metadata'} -
+    # - 'status' is 'success', 'failed' or 'skipped', 'output' the book's final folder when it got that far -
+
+    def __init__(self, options=None, log=logging, watcher=None, browser=None, **overrides):
+        self.options = settings(options, **overrides)
+        self.log = log
+        self.watcher = watcher  # Created on the first book that needs the clipboard
+        self.browser = browser if browser is not None else WebBrowserBackend()
+        data_dir = self.options.data_dir
+        self.journal_file = data_dir / 'queue.jsonl'
+        self.index_file = data_dir / 'library.sqlite'
+        self.mirror_file = data_dir / 'mirror.sqlite'
+        self.template = root_path / 'template.opf'
+
+        # --- Sidecar files to write for every book, in order ---
+        options = self.options
+        self.sidecars = [kind for kind, wanted in [('opf', options.opf), ('info', options.infotxt), ('abs', options.abs_json), ('json', options.json)] if wanted]
+
+        # --- Shared http session for all scrapes, opened by the first request ---
+        # - A client configured before (scrapers.configure_client or an earlier Organizer) is kept, unless a transport is given -
+        if options.transport is not None:
+            configure_client(rate=options.rate, max_connections=options.connections, transport=options.transport, timeout=options.timeout)
+        else:
+            default_client(rate=options.rate, max_connections=options.connections, timeout=options.timeout)
+
+        # --- Local metadata mirror, only used once something has been imported ---
+        self.mirror = MetadataMirror(self.mirror_file) if self.mirror_file.exists() else None
+
+        # --- Metadata cache from previous runs ---
+        self.cache = MetadataCache(data_dir / 'cache.sqlite', refresh=options.refresh)
+
+        # --- [--analyze] Track details for the opf/json sidecars, read once per unchanged file ---
+        # - Only the opf/json sidecars carry the results, without them there's nothing to analyse for -
+        analyze = options.analyze and any(kind in ('opf', 'json') for kind in self.sidecars)
+        if options.analyze and not analyze:
+            log.warning("--analyze does nothing without the opf or json sidecars, the tracks aren't read")
+        self.analyser = AudioAnalyser(data_dir / 'analysis.sqlite', log, options.analyze_workers) if analyze else None
+
+    def clipboard(self):
+        # --- Clipboard watcher, optionally with a stdin/named-pipe channel ---
+        if self.watcher is None:
+            channel = LineChannel(self.options.input) if self.options.input != 'clipboard' else None
+            self.watcher = ClipboardWatcher(PyperclipBackend(), channel)
+        return self.watcher
+
+    def result(self, folder, status, summary, output=None, metadata=None):
+        result = {'folder': folder, 'status': status, 'summary': summary, 'output': output, 'metadata': metadata}
+        self.results.append(result)
+        return result
+
+    def clipboard_queue(self, folder, prepared):
+        # ----- Search for audibooks then monitor clipboard for URL -----
+
+        log = self.log
+        watcher = self.clipboard()
+        book_path = folder.resolve()
+        # - Tags and search page were prepared while the user was on an earlier book (or remembered from a previous run)
+        tags = prepared['tags']
+        log.info(f"Search term: {tags['search_term']}")
+
+        # - Prompt user to copy AudioBook url, the search (or the page chosen last time) may already be open in a background tab
+        if prepared['tab']:
+            print(f"\nSearch page open in a background tab: {prepared['page']}")
+        else:
+            self.browser.open(prepared['page'])
+
+        clipboard_old = watcher.paste()
+        log.debug(f"clipboard_old: {clipboard_old}")
+
+        if urls.previous_contents.search(clipboard_old):  # Remove old script contents from clipboard
+            clipboard_old = '__clipboard_cleared__'
+            watcher.copy(clipboard_old)
+
+        # - Best matches from the local mirror and [--lookahead-matches] the catalog search, shown straight away -
+        candidates = prepared['matches']
+        headings = {'local': 'Local matches:', 'search': 'Search matches:'}
+        for number, candidate in enumerate(candidates, 1):
+            if number == 1 or candidate['source'] != candidates[number - 2]['source']:
+                print(f"\n{headings[candidate['source']]}")
+            authors = ', '.join(author.get('name', '') for author in candidate['product'].get('authors') or [])
+            print(f"  {number}) {candidate['product'].get('title')} by {authors} ({candidate['score']:.2f})\n     {candidate['url']}")
+        if candidates:
+            print(f"Copy a number (1-{len(candidates)}) to use a match")
+
+        # - Wait for  url to be coppied
+        if tags['url']:
+            print(f"\nPreviously matched \"{book_path.name}\" to {tags['url']}\nCopy 'keep' to use it again, another URL to replace it, or 'skip'...", end='')
+        else:
+            print(f"\nCopy the Audible or Goodreads URL for \"{book_path.name}\"\nCopy 'skip' to skip the current book...           ", end='')
+        watcher.arm(clipboard_old)
+        while True:
+            clipboard_current = watcher.next()  # Blocks until the clipboard changes or a url is pasted
+            if clipboard_current == 'keep' and tags['url']:
+                clipboard_current = tags['url']
+            elif clipboard_current.strip().isdigit() and 0 < int(clipboard_current) <= len(candidates):
+                clipboard_current = candidates[int(clipboard_current) - 1]['url']
+
+            if clipboard_current == 'skip':  # user coppied 'skip' to clipboard
+                log.info(f"Skipping: {book_path.name}")
+                print(f"\n\nSkipping: {book_path.name}")
+                self.result(book_path, 'skipped', book_path.name)
+                break
+            elif urls.audible_url.search(clipboard_current):
+                # --- A valid Audible URL ---
+                log.debug(f"Clipboard Audible match: {clipboard_current}")
+
+                audible_url = urls.audible_url.search(clipboard_current)[0]
+                self.journal.queue(book_path, audible_url)
+                self.fetcher.prefetch(book_path, audible_url)
+                if tags['fingerprint']:
+                    self.index.remember(book_path, tags['fingerprint'], url=audible_url)
+                print(f"\n\nAudible URL: {audible_url}")
+                break
+            elif urls.goodreads_url.search(clipboard_current):
+                # --- A valid Goodreads URL
+                log.debug(f"Clipboard GoodReads match: {clipboard_current}")
+
+                goodreads_url = urls.goodreads_url.search(clipboard_current)[0]
+                self.journal.queue(book_path, goodreads_url)
+                self.fetcher.prefetch(book_path, goodreads_url)
+                if tags['fingerprint']:
+                    self.index.remember(book_path, tags['fingerprint'], url=goodreads_url)
+                print(f"\n\nGoodreads URL: {goodreads_url}")
+                break
+            else:
+                continue
+
+        watcher.copy(clipboard_old)
+
+    def book_output(self, folder, metadata):
+        # --- (output path, final output folder) of a scraped book ---
+
+        # ----- [--output] Prepare output folder -----
+        if self.options.output:
+            output_path = Path(self.options.output)
+        else:
+            output_path = folder.parent / f"{default_output}/"
+
+        # - Clean paths -
+        author_clean = re.sub(r"[^\w\-\.\(\) ]+", '', metadata['author'])
+        title_clean = re.sub(r"[^\w\-\.\(\) ]+", '', metadata['title'])
+        self.log.info(f"Cleaned path names: Author ({author_clean} | Title ({title_clean}")
+        author_folder = output_path / f"{author_clean}/"
+        final_output = author_folder / f"{title_clean}/"
+        return output_path, final_output.resolve()
+
+    def process_book(self, folder, metadata, output, done, output_path):
+        # ----- Everything after the scrape for one book, returns (failure, success) summary entries -----
+
+        log = self.log
+        options = self.options
+        journal = self.journal
+        print(f"\n----- {metadata['input_folder']} -----")
+        print(output, end='')
+
+        failure = None
+        if metadata['failed'] is True:
+            failure = f"{metadata['input_folder']} ({metadata['failed_exception']})"
+        if metadata['skip'] is True:
+            return failure, None
+        if 'scrape' not in done:
+            journal.record(folder, 'scrape', metadata=metadata)
+
+        print(f"""
+Title: {metadata['title']}
+Author: {metadata['author']}
+URL: {metadata['url']}""")
+
+        print(f"\nOutput: {metadata['final_output']}")
+
+        # ----- [--dry-run] List the plan for the input folder, nothing is touched -----
+        if options.dry_run:
+            flatten = options.flatten and 'flatten' not in done
+            rename = options.rename and 'rename' not in done
+            source = metadata['final_output'] if 'move' in done else folder
+            if flatten or rename:
+                lines = describe_plan(plan_tracks(source, metadata['title'], log, flatten, rename), source, metadata['final_output'])
+                print('\nTracks:\n' + '\n'.join(lines) if lines else '\nTracks: already in place')
+            files = [sidecar_names[kind] for kind in self.sidecars if kind not in done]
+            if files:
+                print(f"\nWrite: {', '.join(files)}")
+            return failure, f"{folder.stem}/ --> {output_path.stem}/{metadata['author']}/{metadata['title']}/ (dry run)"
+        metadata['final_output'].parent.mkdir(parents=True, exist_ok=True)
+
+        # ----- [--link/--copy] Link/copy/move book folder ---
+        show_progress = not self.post.parallel  # In parallel, the copies share one line printed by the main thread
+        board = self.post.progress
+        if 'move' in done:
+            print("\nAlready in place, resuming...")
+        elif options.link:
+            print("\nLinking...")
+            with profiler.span('link', metadata['input_folder']) as span:
+                span.set(bytes=copy_book(folder, metadata['final_output'], log, options.copy_workers, show_progress=show_progress, link=options.link, link_fallback=options.link_fallback, board=board))
+        elif options.copy:
+            print("\nCopying...")
+            with profiler.span('copy', metadata['input_folder']) as span:
+                span.set(bytes=copy_book(folder, metadata['final_output'], log, options.copy_workers, show_progress=show_progress, board=board))
+        else:  # - Move folder (defult) -
+            print("\nMoving...")
+            with profiler.span('move', metadata['input_folder']) as span:
+                try:
+                    folder.rename(metadata['final_output'])
+                    span.set(bytes=0)
+                except Exception as e:
+                    log.info(f"Couldn't move folder directly, performing copy-move (metadata['title']) | {e}")
+                    span.set(bytes=copy_book(folder, metadata['final_output'], log, options.copy_workers, move=True, show_progress=show_progress, board=board))
+        if 'move' not in done:
+            journal.record(folder, 'move', final_output=metadata['final_output'])
+
+        # ----- [--flatten/--rename] One plan for both, from a single walk of the book folder -----
+        flatten = options.flatten and 'flatten' not in done
+        rename = options.rename and 'rename' not in done
+        if flatten or rename:
+            print('\n' + ' & '.join(step for step, wanted in [('Flattening', flatten), ('Renaming', rename)] if wanted) + '...')
+            with profiler.span('flatten' if flatten else 'rename', metadata['input_folder']) as span:
+                plan = plan_tracks(metadata['final_output'], metadata['title'], log, flatten, rename)
+                span.set(moves=len(plan[0]))
+                apply_plan(plan, metadata['final_output'], log)
+            if flatten:
+                journal.record(folder, 'flatten')
+            if rename:
+                journal.record(folder, 'rename')
+
+        # ----- [--analyze] Runtime, bitrate and track count of the organized tracks, only needed by the opf/json sidecars -----
+        if self.analyser is not None and any(kind in ('opf', 'json') and kind not in done for kind in self.sidecars):
+            print("\nAnalyzing...")
+            metadata['audio'] = self.analyser.analyse(metadata['final_output'], metadata['input_folder'])
+            print(f"{metadata['audio']['tracks']} tracks, {metadata['audio']['runtime']}, {metadata['audio']['bitrate']:g} kbps")
+
+        # ----- [--opf/--infotxt/--abs-json/--json] Sidecar files, rendered here and written in the background -----
+        pending = []
+        for kind in self.sidecars:
+            if kind in done:
+                continue
+            print(f"\nCreating '{sidecar_names[kind]}'")
+            with profiler.span(kind, metadata['input_folder']):
+                text = render(kind, metadata, self.template)
+            pending.append(self.writer.write(metadata['final_output'] / sidecar_names[kind], text, metadata['input_folder'], functools.partial(journal.record, folder, kind)))
+
+        # ---- Folder complete, once its sidecars are on disk ----
+        if pending:
+            self.writer.when_written(pending, functools.partial(journal.record, folder, 'complete'))
+        else:
+            journal.record(folder, 'complete')
+        print("\nDone!")
+        return failure, f"{folder.stem}/ --> {output_path.stem}/{metadata['author']}/{metadata['title']}/"
+
+    def report(self, folder, metadata, result, output):
+        # --- Print a finished book and add its result, in queue order ---
+        print(output, end='')
+        final_output = metadata.get('final_output')
+        if isinstance(result, Exception):
+            print(f"\nFailed: {result}")
+            self.result(folder, 'failed', f"{folder.name} (Processing error: {result})", final_output, metadata)
+            return
+        failure, success = result
+        if failure:
+            self.result(folder, 'failed', failure, None, metadata)
+        elif success:
+            self.result(folder, 'success', success, final_output, metadata)
+        else:
+            self.result(folder, 'skipped', folder.name, None, metadata)
+
+    def organize(self, folders, resume=False):
+        # ----- Queue then process a list of folders (or a LibraryScan), returns the result of every book -----
+
+        log = self.log
+        options = self.options
+        self.results = []
+        lookahead = None
+        self.writer = self.fetcher = self.journal = self.index = self.prober = self.post = None  # Closed in the finally, whichever were created
+
+        try:
+            # ===== Metadata is fetched in the background as soon as each url is copied =====
+            debug_page = options.data_dir / 'goodreads_page.html' if options.debug else False
+            self.writer = SidecarWriter(log)
+            self.fetcher = Fetcher(log, options.workers, debug_page, self.cache, self.mirror, options.retries)
+
+            # ===== Build the queue using the journal =====
+            self.journal = Journal(self.journal_file, log, resume=resume)
+            self.index = LibraryIndex(self.index_file)
+            if isinstance(folders, LibraryScan):  # [--scan] Folders stream in, probing follows the walk
+                self.prober = TagProber([], log, ahead=options.lookahead, index=self.index)
+                folders.watch(self.prober.add)
+                folders = (folder for folder in folders if not self.journal.queued(folder))  # [--resume] Already queued last time
+            else:
+                folders = [Path(folder).resolve() for folder in folders]
+                folders = [folder for folder in folders if not self.journal.queued(folder)]  # [--resume] Already queued last time
+                self.prober = TagProber(folders, log, ahead=options.lookahead, index=self.index)
+
+            # --- [--auto] Confident Audible search matches are queued without user input, the rest go to the clipboard ---
+            if options.auto:
+                print('\n===================================== AUTO MATCH ====================================')
+                remaining = []
+                for folder, match, output in auto_match(folders, self.prober, log, options.auto_threshold, options.workers, self.mirror):
+                    print(output, end='')
+                    if match['url'] is None:
+                        print(f"\nManual: {folder.name} ({match['reason']})")
+                        remaining.append(folder)
+                        continue
+                    self.journal.queue(folder, match['url'])
+                    self.fetcher.prefetch(folder, match['url'], match['product'])
+                    if match['tags']['fingerprint']:
+                        self.index.remember(folder, match['tags']['fingerprint'], url=match['url'])
+                    print(f"\nMatched: {folder.name} --> {match['product'].get('title')} ({match['score']:.2f})")
+                folders = remaining
+                print('\n-------------------------------------------')
+
+            # --- The next books' searches are prepared while the user copies a url for the current one ---
+            lookahead = SearchLookahead(self.prober, self.browser, log, options.lookahead, options.site, options.lookahead_tabs, options.lookahead_matches, self.mirror)
+            for folder, prepared in lookahead.books(folders):
+                self.clipboard_queue(folder, prepared.result())
+                print('\n-------------------------------------------')
+            lookahead.close()
+            self.prober.close()
+            self.index.close()
+
+            print('\n===================================== PROCESSING ====================================')
+
+            # --- Prefetched metadata is reused, the rest is requested concurrently, results arrive in queue order ---
+            # --- Books are then processed across a pool, limited per source/destination device, and reported in queue order ---
+            self.post = PostProcessor(log, options.book_workers, options.device_limit)
+            order = deque()
+            for folder, metadata, output in self.fetcher.results(self.journal.books()):
+                done = metadata.pop('done_stages', [])  # [--resume] Stages finished in an earlier run
+                output_path = None
+                if metadata['skip'] is False:
+                    output_path, final_output = self.book_output(folder, metadata)
+                    if 'move' not in done:
+                        metadata['final_output'] = final_output
+                order.append((folder, metadata))
+                self.post.submit(self.process_book, [folder, metadata.get('final_output', folder)], metadata.get('final_output'), folder, metadata, output, done, output_path)
+                for result, text in self.post.finished():
+                    self.report(*order.popleft(), result, text)
+            for result, text in self.post.drain():
+                self.report(*order.popleft(), result, text)
+            self.post.close()
+
+            # --- A failed sidecar write fails its book ---
+            self.writer.close()
+            for path, exc in self.writer.errors:
+                for result in self.results:
+                    if result['output'] is not None and Path(result['output']) == path.parent:
+                        result.update(status='failed', summary=f"{path.parent.name} (Sidecar write error, {path.name}: {exc})")
+                        break
+                else:
+                    self.result(path.parent, 'failed', f"{path.parent.name} (Sidecar write error, {path.name}: {exc})")
+            return self.results
+        finally:
+            # - Also after an error part way, so stdout is restored and no thread or file is left open for the next call -
+            # - Stages already closed in order above are closed again, which is harmless -
+            for stage in (lookahead, self.prober, self.index, self.post, self.writer, self.fetcher, self.journal):
+                if stage is not None:
+                    stage.close()
+
+    def close(self):
+        self.cache.close()
+        if self.mirror is not None:
+            self.mirror.close()
+        self.log.info(f"Metadata cache: {self.cache.hits} hits, {self.cache.misses} misses")
+        if self.analyser is not None:
+            self.analyser.close()
+            self.log.info(f"Audio analysis: {self.analyser.misses} tracks read, {self.analyser.hits} cached")
+
+
+def organize(folders, options=None, log=logging, **overrides):
+    # --- Organize one batch of folders with a short-lived Organizer, keep an Organizer around for many batches ---
+    organizer = Organizer(options, log, **overrides)
+    try:
+        return organizer.organize(folders)
+    finally:
+        organizer.close()
@@ -0,0 +1,129 @@
+# --- Post-processing pool, books are moved/copied/renamed in parallel with a limit per disk ---
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+
+from copier import ProgressBoard
+
+
+def device(path):
+    # --- st_dev of a path, or of its nearest existing parent (outputs don't exist yet) ---
+    path = Path(path)
+    for candidate in [path, *path.parents]:
+        try:
+            return os.stat(candidate).st_dev
+        except OSError:
+            continue
+    return None
+
+
+class DeviceLimiter:
+    # --- One semaphore per device, a book holds the devices it reads from and writes to ---
+
+    def __init__(self, limit=2):
+        self.limit = max(1, limit)
+        self.lock = threading.Lock()
+        self.semaphores = {}  # st_dev: semaphore
+
+    def semaphore(self, dev):
+        with self.lock:
+            if dev not in self.semaphores:
+                self.semaphores[dev] = threading.Semaphore(self.limit)
+            return self.semaphores[dev]
+
+    @contextmanager
+    def hold(self, *paths):
+        # - Always acquired in device order, two books can't each hold the other's disk -
+        semaphores = [self.semaphore(dev) for dev in sorted({device(path) for path in paths}, key=str)]
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                semaphore.acquire()
+                acquired.append(semaphore)
+            yield
+        finally:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+
+
+class PostProcessor:
+    # ----- Runs a function per book, results come back in submission order with everything it printed -----
+    # - With a single worker books run inline in the main thread, so progress is printed live -
+    # - In parallel, copies add themselves to 'progress' and drain() shows them as one line while it waits -
+
+    def __init__(self, log, workers=4, device_limit=2):
+        self.log = log
+        self.parallel = workers > 1
+        self.limiter = DeviceLimiter(device_limit)
+        self.executor = ThreadPoolExecutor(max_workers=workers) if self.parallel else None
+        self.progress = ProgressBoard() if self.parallel else None
+        self.shown = 0  # Length of the progress line on screen
+        self.pending = deque()  # Futures in submission order
+        self.outputs = {}  # final_output: future, books going to the same folder run one after another
+
+    def submit(self, function, paths, output, *args):
+        # --- 'paths' decide the devices held while the book runs, 'output' its destination folder ---
+        if not self.parallel:
+            future = Future()
+            future.set_result(self.run(None, paths, function, args, capture=False))
+        else:
+            previous = self.outputs.get(output) if output is not None else None
+            future = self.executor.submit(self.run, previous, paths, function, args)  # Submitted after 'previous', the pool starts it first
+            if output is not None:
+                self.outputs = {key: value for key, value in self.outputs.items() if not value.done()}
+                self.outputs[output] = future
+        self.pending.append(future)
+
+    def run(self, previous, paths, function, args, capture=True):
+        # --- (result, output), an exception is returned as the result ---
+        if previous is not None:
+            wait([previous])
+        if capture:
+            sys.stdout.capture()
+        try:
+            with self.limiter.hold(*paths):
+                result = function(*args)
+        except Exception as exc:
+            self.log.exception(f"Post-processing error: {exc}")
+            result = exc
+        finally:
+            output = sys.stdout.release() if capture else ''
+        return result, output
+
+    def finished(self):
+        # --- Yield results from the front of the queue that are already done ---
+        while self.pending and self.pending[0].done():
+            self.clear_progress()
+            yield self.pending.popleft().result()
+        self.show_progress()
+
+    def drain(self):
+        # --- Yield every remaining result, waiting for each in order ---
+        while self.pending:
+            future = self.pending.popleft()
+            while not future.done():
+                wait([future], timeout=0.5)
+                self.show_progress()
+            self.clear_progress()  # The book's own output is printed next
+            yield future.result()
+
+    def show_progress(self):
+        line = self.progress.line() if self.progress is not None else ''
+        if line:
+            sys.stdout.write(f"\r{line.ljust(self.shown)}")
+            sys.stdout.flush()
+            self.shown = len(line)
+
+    def clear_progress(self):
+        if self.shown:
+            sys.stdout.write(f"\r{' ' * self.shown}\r")
+            sys.stdout.flush()
+            self.shown = 0
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
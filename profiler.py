@@ -0,0 +1,101 @@
+# --- [--profile] Per-stage timing spans, written as a Chrome trace (chrome://tracing, Perfetto) ---
+import json
+import os
+import threading
+import time
+
+
+class NullSpan:
+    # --- Returned while profiling is disabled, does nothing ---
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+null_span = NullSpan()
+
+
+class Span:
+
+    def __init__(self, profiler, stage, book, args):
+        self.profiler = profiler
+        self.stage = stage
+        self.book = book
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.profiler.record(self, time.perf_counter() - self.start, exc_type)
+        return False
+
+    def set(self, **args):
+        # --- Attach details to the span, eg: bytes=..., status=... ---
+        self.args.update(args)
+
+
+class Profiler:
+    # ----- Collects a span for every stage of every book when enabled -----
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self.origin = time.perf_counter()
+
+    def span(self, stage, book='', **args):
+        if not self.enabled:
+            return null_span
+        return Span(self, stage, book, args)
+
+    def record(self, span, duration, exc_type):
+        args = dict(span.args, book=span.book)
+        if exc_type is not None:
+            args['error'] = exc_type.__name__
+        event = {
+            'name': span.stage,
+            'cat': 'stage',
+            'ph': 'X',
+            'ts': round((span.start - self.origin) * 1e6, 1),
+            'dur': round(duration * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def write_trace(self, path):
+        with self.lock:
+            events = list(self.events)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def table(self):
+        # --- p50/p95/max per stage, in the order stages first appeared ---
+        stages = {}
+        with self.lock:
+            for event in self.events:
+                stages.setdefault(event['name'], []).append(event['dur'] / 1000)
+        lines = [f"{'Stage':<16}{'Count':>7}{'p50 ms':>12}{'p95 ms':>12}{'Max ms':>12}{'Total s':>11}"]
+        for stage, durations in stages.items():
+            durations.sort()
+            p50 = durations[max(0, -(-len(durations) * 50 // 100) - 1)]
+            p95 = durations[max(0, -(-len(durations) * 95 // 100) - 1)]
+            lines.append(f"{stage:<16}{len(durations):>7}{p50:>12.1f}{p95:>12.1f}{durations[-1]:>12.1f}{sum(durations) / 1000:>11.2f}")
+        return '\n'.join(lines)
+
+
+profiler = Profiler()
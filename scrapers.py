@@ -1,9 +1,221 @@
 # --- Functions that scrape the parsed webpage for metadata ---
 import json
+import threading
 import time
 import re
-import requests
-from bs4 import BeautifulSoup
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from profiler import profiler
+
+# --- requests and bs4 are imported by the functions that use them, so importing this module stays cheap ---
+
+user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:108.0) Gecko/20100101 Firefox/108.0'
+
+# --- Requests per second allowed for each host (matched by domain suffix) ---
+host_rates = {
+    'goodreads.com': 1.0,
+    'audible.com': 5.0,
+}
+default_rate = 5.0
+
+# --- Transient failures, the book is retried later instead of failing ---
+retry_statuses = {429, 500, 502, 503, 504}
+max_retry_after = 300  # Seconds, a longer Retry-After is capped
+breaker_threshold = 5  # Errors in a row before a host is paused
+breaker_cooldown = 30.0  # Seconds a paused host gets before a single probe request
+request_timeout = (10.0, 30.0)  # Seconds to connect, and to wait for each part of the response, a stalled request is retried
+
+# --- Audible catalog api ---
+audible_products_url = 'https://api.audible.com/1.0/catalog/products'
+audible_response_groups = 'contributors,product_desc,series,product_extended_attrs,media'
+audible_batch_size = 50  # ASINs per multi-product request
+
+
+class TokenBucket:
+    # --- Thread-safe token bucket, take() blocks until a request may be sent ---
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RetryLater(Exception):
+    # --- A transient failure, 'delay' is the server's Retry-After (None to use the caller's backoff) ---
+
+    def __init__(self, reason, delay=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.delay = delay
+
+
+class HostUnavailable(RetryLater):
+    # --- Raised without a request while a host's circuit breaker is open ---
+    pass
+
+
+def retry_after(response):
+    # --- Seconds from a Retry-After header (delta-seconds or an http date), None if absent/unreadable ---
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max_retry_after, max(0.0, seconds))
+
+
+class CircuitBreaker:
+    # --- Per host: paused after 'threshold' errors in a row (or by a Retry-After), then one probe at a time ---
+
+    def __init__(self, threshold=breaker_threshold, cooldown=breaker_cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.paused_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def check(self):
+        # --- 0 if a request may be sent now, otherwise the seconds to wait ---
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            if self.failures < self.threshold:
+                return 0
+            if self.probing:  # Half open, the probe hasn't come back yet
+                return 1.0
+            self.probing = True
+            return 0
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+
+    def failure(self, pause=None):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.threshold:
+                pause = max(pause or 0, self.cooldown)
+            if pause:
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+
+class HttpClient:
+    # --- Shared keep-alive session, rate limited per host and capped at max_connections per host ---
+
+    def __init__(self, rate=None, burst=1, max_connections=4, transport=None, timeout=None):
+        self.rate = rate  # None uses host_rates/default_rate
+        self.burst = burst
+        self.timeout = timeout if timeout is not None else request_timeout  # (connect, read) or one number for both
+        self.buckets = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+        self.max_connections = max_connections
+        self.transport = transport  # Injectable for tests, any requests adapter (eg: one pointing at a stub server)
+        self.session = None  # Opened by the first request, so configuring the client doesn't import requests
+
+    def connect(self):
+        with self.lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                session.headers.update({'user-agent': user_agent})
+                transport = self.transport
+                if transport is None:
+                    transport = HTTPAdapter(pool_connections=8, pool_maxsize=self.max_connections, pool_block=True)
+                session.mount('https://', transport)
+                session.mount('http://', transport)
+                self.session = session
+            return self.session
+
+    def bucket(self, host):
+        with self.lock:
+            if host not in self.buckets:
+                rate = self.rate
+                if rate is None:
+                    rate = next((value for domain, value in host_rates.items() if host == domain or host.endswith(f".{domain}")), default_rate)
+                self.buckets[host] = TokenBucket(rate, self.burst)
+            return self.buckets[host]
+
+    def breaker(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker()
+            return self.breakers[host]
+
+    def get(self, url, **kwargs):
+        # --- Raises HostUnavailable instead of sending while the host is paused ---
+        host = urlsplit(url).hostname or ''
+        breaker = self.breaker(host)
+        wait = breaker.check()
+        if wait:
+            raise HostUnavailable(f"{host} paused after repeated errors", wait)
+        if self.rate != 0:
+            self.bucket(host).take()
+        session = self.connect()
+        kwargs.setdefault('timeout', self.timeout)
+        import requests
+        try:
+            response = session.get(url, **kwargs)
+        except requests.RequestException:
+            breaker.failure()
+            raise
+        if response.status_code in retry_statuses:
+            breaker.failure(retry_after(response))
+        else:
+            breaker.success()
+        return response
+
+
+client = None  # Created by the first request, or configure_client()
+client_lock = threading.Lock()
+
+
+def configure_client(rate=None, burst=1, max_connections=4, transport=None, timeout=None):
+    # --- Replace the shared client, called once from the command-line options ---
+    global client
+    client = HttpClient(rate, burst, max_connections, transport, timeout)
+    return client
+
+
+def default_client(rate=None, burst=1, max_connections=4, transport=None, timeout=None):
+    # --- Configure the shared client unless one exists, a client set up earlier keeps its transport, limiter and breakers ---
+    global client
+    with client_lock:
+        if client is None:
+            client = HttpClient(rate, burst, max_connections, transport, timeout)
+        return client
+
+
+def shared_client():
+    with client_lock:
+        if client is None:
+            configure_client()
+        return client
 
 
 def http_request(metadata, log, url=False, query=False):
@@ -11,35 +223,30 @@ def http_request(metadata, log, url=False, query=False):
 
     log.info(f"Metadata URL for get() request: {metadata['url']}")
 
-    # --- Request webpage ---
-    timer = 2
-    while True:
-        try:
+    # --- Request webpage, transient failures are left to the caller to retry later ---
+    try:
+        with profiler.span('http_request', metadata['input_folder'], url=url or metadata['url']) as span:
             if url and query:
-                html_response = requests.get(url, params=query, headers={'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:108.0) Gecko/20100101 Firefox/108.0'})
+                html_response = shared_client().get(url, params=query)
             else:
-                html_response = requests.get(metadata['url'], headers={'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:108.0) Gecko/20100101 Firefox/108.0'})
-        except Exception as exc:
-            log.error(f"Requests HTML get error: {exc}")
-            if timer == 2:
-                print('\n\nBad response from webpage, retrying for up-to 25 seconds...')
-            elif timer >= 10:
-                log.error(f"Requests HTML get error: {exc}")
-                print(f"Failed to get webpage page, skipping {metadata['input_folder']}...")
-                metadata['skip'] = True
-                metadata['failed'] = True
-                metadata['failed_exception'] = f"{metadata['input_folder']}: Requests HTML get error: {exc}"
-                break
-            time.sleep(timer)
-            timer = timer * 1.5
-        else:
-            break
+                html_response = shared_client().get(metadata['url'])
+            span.set(status=html_response.status_code, bytes=len(html_response.content))
+    except RetryLater:
+        raise
+    except Exception as exc:
+        import requests
+        if isinstance(exc, requests.Timeout):  # Connected too slowly or stopped answering
+            log.error(f"Requests timed out: {exc}")
+            raise RetryLater(f"Request timed out: {exc}")
+        log.error(f"Requests HTML get error: {exc}")
+        raise RetryLater(f"Requests HTML get error: {exc}")
 
-    if metadata['failed']:
-        return metadata, html_response
+    if html_response.status_code in retry_statuses:
+        log.error(f"Requests retryable status: {html_response.status_code}")
+        raise RetryLater(f"Requests status code = {html_response.status_code}", retry_after(html_response))
 
     log.info(f"Requests Status code: {str(html_response.status_code)}")
-    if html_response.status_code != requests.codes.ok:
+    if html_response.status_code != 200:
         log.error(f"Requests error: {str(html_response.status_code)}")
         print(f"Bad requests status code, skipping {metadata['input_folder']}: {html_response.status_code}")
         metadata['skip'] = True
@@ -61,6 +268,84 @@ def http_request(metadata, log, url=False, query=False):
         return metadata, html_response
 
 
+def audible_products(asins, log):
+    # --- Request several ASINs in one catalog call, returns {asin: product} for the ones Audible sent back ---
+
+    metadata = {'url': audible_products_url, 'input_folder': f"{len(asins)} ASIN batch", 'skip': False, 'failed': False, 'failed_exception': ''}
+    query = {'asins': ','.join(asins), 'response_groups': audible_response_groups}
+    try:
+        metadata, response = http_request(metadata, log, audible_products_url, query)
+        if metadata['skip'] is True:
+            return {}
+        products = response.json()['products']
+    except Exception as exc:
+        log.error(f"Audible batch request error ({','.join(asins)}): {exc}")
+        return {}
+
+    return {product['asin']: product for product in products if 'asin' in product}
+
+
+# --- Anchors for the goodreads fast path, only these parts of the page get parsed ---
+goodreads_type1 = re.compile(r"""\sid=["']bookTitle["']""")
+goodreads_ld_json = re.compile(r"""<script[^>]*type=["']application/ld\+json["'][^>]*>.*?</script>""", re.S)
+goodreads_fragments = [
+    re.compile(r"""<div[^>]*data-testid=["']description["']"""),
+    re.compile(r"""<div[^>]*class=["']BookPageTitleSection__title["']"""),
+]
+div_tags = re.compile(r"<(/?)div\b")
+
+
+def element_html(text, start):
+    # --- The html of the <div> starting at 'start', through its matching closing tag ---
+    depth = 0
+    for tag in div_tags.finditer(text, start):
+        depth += -1 if tag[1] else 1
+        if depth == 0:
+            return text[start:text.index('>', tag.end()) + 1]
+    return None
+
+
+def goodreads_fast_parse(text):
+    # ----- Parse only the ld+json, description and title section of a goodreads page -----
+    # - Returns None (use the full parse) for old layout pages or when an anchor can't be cut out cleanly -
+
+    if goodreads_type1.search(text):
+        return None
+    script = goodreads_ld_json.search(text)
+    if script is None:
+        return None
+
+    fragments = [script[0]]
+    for anchor in goodreads_fragments:
+        match = anchor.search(text)
+        if match is None:
+            continue
+        fragment = element_html(text, match.start())
+        if fragment is None:
+            return None
+        fragments.append(fragment)
+
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(''.join(fragments), 'html.parser')
+
+
+def audible_search(title, author, log, input_folder=''):
+    # --- Catalog search by title/author, returns the candidate products (empty on failure) ---
+
+    metadata = {'url': audible_products_url, 'input_folder': input_folder or title, 'skip': False, 'failed': False, 'failed_exception': ''}
+    query = {'title': title, 'num_results': 10, 'products_sort_by': 'Relevance', 'response_groups': f"{audible_response_groups},product_attrs"}
+    if author:
+        query['author'] = author
+    try:
+        metadata, response = http_request(metadata, log, audible_products_url, query)
+        if metadata['skip'] is True:
+            return []
+        return response.json()['products']
+    except Exception as exc:
+        log.error(f"Audible search error ({title}): {exc}")
+        return []
+
+
 def api_audible(metadata, page, log):
     # ----- Get metadata from Audible.com API -----
 
@@ -91,6 +376,7 @@ def api_audible(metadata, page, log):
 
     # --- Summary ---
     try:
+        from bs4 import BeautifulSoup
         summary_dirty = BeautifulSoup(page['publisher_summary'], 'html.parser')
         metadata['summary'] = summary_dirty.getText()
         log.info(f"summary element: {str(summary_dirty)}")
@@ -0,0 +1,184 @@
+# --- Sidecar files written next to each book: metadata.opf, info.txt, Audiobookshelf metadata.json and a JSON dump ---
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from cache import cached_fields
+from profiler import profiler
+
+placeholder = re.compile(r"__(AUTHOR|TITLE|SUMMARY|SUBTITLE|NARRATOR|PUBLISHER|PUBLISHYEAR|GENRES|ISBN|ASIN|SERIES|VOLUMENUMBER|DURATION|TRACKS|BITRATE|CHANNELS)__")
+xml_entities = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&apos;'})  # Placeholders also sit inside attribute values
+
+# --- File name of each sidecar ---
+sidecar_names = {
+    'opf': 'metadata.opf',
+    'info': 'info.txt',
+    'abs': 'metadata.json',
+    'json': 'badaboombooks.json',
+}
+
+
+class OpfTemplate:
+    # --- template.opf, read once and split on its placeholders so a book renders in a single pass ---
+
+    def __init__(self, path):
+        with Path(path).open('r') as file:
+            self.parts = placeholder.split(file.read())  # Text and placeholder names alternate
+
+    def render(self, metadata):
+        values = opf_values(metadata)
+        return ''.join(part if index % 2 == 0 else values[part].translate(xml_entities) for index, part in enumerate(self.parts))
+
+
+templates = {}
+templates_lock = threading.Lock()
+
+
+def opf_template(path):
+    # --- Compiled template for a path, shared by every book ---
+    path = Path(path).resolve()
+    with templates_lock:
+        if path not in templates:
+            templates[path] = OpfTemplate(path)
+        return templates[path]
+
+
+def opf_values(metadata):
+    # --- Placeholder values, a fallback author/title is left blank ---
+    values = {field.upper(): str(metadata.get(field) or '') for field in
+              ['author', 'title', 'summary', 'subtitle', 'narrator', 'publisher', 'publishyear', 'genres', 'isbn', 'asin', 'series', 'volumenumber']}
+    if metadata['author'] == '__unknown__':
+        values['AUTHOR'] = ''
+    if metadata['title'] == metadata['input_folder']:
+        values['TITLE'] = ''
+    audio = metadata.get('audio') or {}  # [--analyze] Left blank when the tracks weren't read
+    for field in ['duration', 'tracks', 'bitrate', 'channels']:
+        values[field.upper()] = str(audio.get(field, ''))
+    return values
+
+
+def names(metadata, single, multi):
+    # --- Every name of a multi-valued field (Audible gives dicts), or just the single one ---
+    if metadata.get(multi):
+        return [entry['name'] if isinstance(entry, dict) else str(entry) for entry in metadata[multi]]
+    return [metadata[single]] if metadata.get(single) else []
+
+
+def render_info(metadata):
+    return metadata['summary']
+
+
+def render_abs(metadata):
+    # ----- Audiobookshelf metadata.json (the server's own sidecar format) -----
+
+    series = []
+    for entry in metadata.get('series_multi') or []:
+        if isinstance(entry, dict) and entry.get('title'):
+            series.append(f"{entry['title']} #{entry['sequence']}" if entry.get('sequence') else entry['title'])
+    if not series and metadata.get('series'):
+        series.append(f"{metadata['series']} #{metadata['volumenumber']}" if metadata.get('volumenumber') else metadata['series'])
+
+    authors = [] if metadata['author'] in ('_unknown_', '__unknown__') else names(metadata, 'author', 'authors_multi')
+    sidecar = {
+        'tags': [],
+        'chapters': [],
+        'title': '' if metadata['title'] == metadata['input_folder'] else metadata['title'],
+        'subtitle': metadata.get('subtitle') or None,
+        'authors': authors,
+        'narrators': names(metadata, 'narrator', 'narrators_multi'),
+        'series': series,
+        'genres': [genre.strip() for genre in str(metadata.get('genres') or '').split(',') if genre.strip()],
+        'publishedYear': metadata.get('publishyear') or None,
+        'publishedDate': None,
+        'publisher': metadata.get('publisher') or None,
+        'description': metadata.get('summary') or None,
+        'isbn': metadata.get('isbn') or None,
+        'asin': metadata.get('asin') or None,
+        'language': None,
+        'explicit': False,
+        'abridged': False,
+    }
+    return json.dumps(sidecar, indent=2, ensure_ascii=False)
+
+
+def render_json(metadata):
+    # --- Everything that was scraped, plus where it came from ---
+    sidecar = {field: metadata[field] for field in cached_fields if field in metadata}
+    sidecar['url'] = metadata['url']
+    if metadata.get('audio'):
+        sidecar['audio'] = metadata['audio']
+    return json.dumps(sidecar, indent=2, ensure_ascii=False, default=str)
+
+
+def render(kind, metadata, template=None):
+    # --- Text of a sidecar ('opf', 'info', 'abs' or 'json') ---
+    if kind == 'opf':
+        return opf_template(template).render(metadata)
+    elif kind == 'info':
+        return render_info(metadata)
+    elif kind == 'abs':
+        return render_abs(metadata)
+    return render_json(metadata)
+
+
+def atomic_write(path, text):
+    # --- Temp file in the same folder then a rename, readers never see half a file ---
+    path = Path(path)
+    temporary = path.with_name(f".{path.name}.tmp")
+    try:
+        with temporary.open('w', encoding='utf-8') as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        raise
+
+
+class SidecarWriter:
+    # ----- Background writer, the main loop only renders and queues the text -----
+
+    def __init__(self, log, workers=2):
+        self.log = log
+        self.errors = []  # (path, exception) of failed writes
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def write(self, path, text, book='', done=None):
+        # --- Queue a write, 'done' is called from the writer thread once the file is on disk ---
+        return self.executor.submit(self.worker, Path(path), text, book, done)
+
+    def worker(self, path, text, book, done):
+        try:
+            with profiler.span('write', book, file=path.name, bytes=len(text.encode('utf-8'))):
+                atomic_write(path, text)
+        except Exception as exc:
+            self.log.error(f"Sidecar write error ({path}): {exc}")
+            self.errors.append((path, exc))
+            return False
+        self.log.debug(f"Sidecar written: {path}")
+        if done is not None:
+            done()
+        return True
+
+    def when_written(self, futures, done):
+        # --- Call 'done' once every write in futures has succeeded ---
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def finished(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            if all(future.result() for future in futures):
+                done()
+
+        for future in futures:
+            future.add_done_callback(finished)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
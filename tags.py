@@ -0,0 +1,153 @@
+# --- ID3 tag probing for search terms, read ahead of the user in a thread pool ---
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from pathlib import Path
+
+from library import fingerprint
+from profiler import profiler
+
+# --- Audio file suffixes, lowercase, shared by the probe, [--scan], track planning and [--analyze] ---
+audio_suffixes = ['.mp3', '.m4a', '.m4b', '.ogg', '.wma', '.flac']
+
+
+def is_audio(name):
+    return os.path.splitext(name)[1].lower() in audio_suffixes
+
+
+def candidate_files(book_path, limit=8):
+    # --- Up to 'limit' audio files, shallowest folders first and sorted by name within a folder ---
+    found = []
+    level = [str(book_path)]
+    while level and len(found) < limit:
+        next_level = []
+        for directory in level:
+            try:
+                entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    next_level.append(entry.path)
+                elif is_audio(entry.name) and len(found) < limit:
+                    found.append(Path(entry.path))
+        level = next_level
+    return found
+
+
+def search_term(book_path, title, author):
+    # --- '{title} by {author}', falling back to the folder name ---
+    if title and author:
+        return f"{title} by {author}"
+    elif title:
+        return title
+    else:
+        return str(Path(book_path).name)
+
+
+def probe_tags(book_path, log, limit=8):
+    # ----- Read album/artist from the first candidate file that has them -----
+    with profiler.span('tag_read', Path(book_path).name):
+        return read_tags(book_path, log, limit)
+
+
+def read_tags(book_path, log, limit):
+
+    title = False
+    author = False
+    narrator = False
+    duration = False
+
+    files = candidate_files(book_path, limit)
+    for file in files:
+        log.debug(f"TinyTag audio file: {file}")
+        try:
+            from tinytag import TinyTag
+            track = TinyTag.get(str(file))
+            title = re.sub(r"\&", 'and', track.album).strip()
+            if title == '':
+                title = False
+            author = re.sub(r"\&", 'and', track.artist).strip()
+            if author == '':
+                author = False
+            narrator = (track.composer or '').strip() or False  # Audiobooks usually tag the narrator as composer
+            if len(files) == 1 and track.duration:  # Only a single-file book gives the whole runtime
+                duration = track.duration
+            break
+        except Exception as e:
+            log.debug(f"Couldn't get search term metadata from ID3 tags, using foldername ({file}) | {e}")
+
+    return {'title': title, 'author': author, 'narrator': narrator, 'duration': duration, 'search_term': search_term(book_path, title, author)}
+
+
+def probe_folder(book_path, log, limit=8, index=None):
+    # --- Tags for a folder, reused from the library index when the folder hasn't changed ---
+    if index is None:
+        result = probe_tags(book_path, log, limit)
+        result.update({'fingerprint': None, 'url': None})
+        return result
+
+    current = fingerprint(book_path)
+    known = index.lookup(book_path, current)
+    if known is not None and known['tags'] is not None:
+        log.debug(f"Library index hit, tags not re-read ({book_path})")
+        result = dict(known['tags'])
+    else:
+        result = probe_tags(book_path, log, limit)
+        index.remember(book_path, current, tags=result)
+    result.update({'fingerprint': current, 'url': known['url'] if known is not None else None})
+    return result
+
+
+class TagProber:
+    # ----- Probe the tags of the next 'ahead' folders while the user works on the current one -----
+
+    def __init__(self, folders, log, ahead=4, limit=8, timeout=10, workers=4, index=None):
+        self.folders = [Path(folder).resolve() for folder in folders]
+        self.positions = {}
+        for position, folder in enumerate(self.folders):
+            self.positions.setdefault(folder, position)
+        self.log = log
+        self.ahead = ahead
+        self.limit = limit
+        self.timeout = timeout
+        self.index = index
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def add(self, folder):
+        # --- A folder found after the prober was created ([--scan]), probed once it's within reach ---
+        folder = Path(folder).resolve()
+        with self.lock:
+            if folder not in self.positions:
+                self.positions[folder] = len(self.folders)
+                self.folders.append(folder)
+
+    def submit(self, folder):
+        with self.lock:  # probe() is also called from the --auto search threads
+            if folder not in self.futures:
+                self.futures[folder] = self.executor.submit(probe_folder, folder, self.log, self.limit, self.index)
+            return self.futures[folder]
+
+    def probe(self, folder):
+        # --- Tags for 'folder', queueing up the folders after it ---
+        folder = Path(folder).resolve()
+        future = self.submit(folder)
+        with self.lock:
+            position = self.positions.get(folder, len(self.folders))
+            upcoming = self.folders[position + 1:position + 1 + self.ahead]
+        for upcoming in upcoming:
+            self.submit(upcoming)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self.log.info(f"Tag probing timed out after {self.timeout}s, using foldername ({folder})")
+        except Exception as e:
+            self.log.debug(f"Tag probing failed, using foldername ({folder}) | {e}")
+        return {'title': False, 'author': False, 'search_term': search_term(folder, False, False), 'fingerprint': None, 'url': None}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
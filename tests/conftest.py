@@ -0,0 +1,6 @@
+# --- The modules are scripts next to BadaBoomBooks.py, the stub server lives with the benchmarks ---
+import sys
+from pathlib import Path
+
+root_path = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(root_path), str(root_path / 'benchmarks')]
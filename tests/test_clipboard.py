@@ -0,0 +1,76 @@
+# --- ClipboardWatcher latency and the stdin / named pipe line channels ---
+import os
+import sys
+import threading
+import time
+
+from clipboard import ClipboardWatcher, FakeClipboard, LineChannel
+
+
+def copy_later(clipboard, text, delay):
+    timer = threading.Timer(delay, clipboard.set, [text])
+    timer.start()
+    return timer
+
+
+def test_change_is_seen_within_the_fast_interval():
+    clipboard = FakeClipboard('old')
+    watcher = ClipboardWatcher(clipboard, fast_interval=0.02)
+    watcher.arm('old')
+    copy_later(clipboard, 'https://www.audible.com/pd/Book/B000000001', 0.1)
+    assert watcher.next() == 'https://www.audible.com/pd/Book/B000000001'
+    assert time.monotonic() - clipboard.changed < 0.1  # A few polls at most, not the old 1 second sleep
+
+
+def test_unchanged_clipboard_is_not_returned():
+    clipboard = FakeClipboard('old')
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) == 5:
+            clipboard.set('skip')
+
+    watcher = ClipboardWatcher(clipboard, sleep=sleep)
+    watcher.arm('old')
+    assert watcher.next() == 'skip'
+    assert clipboard.pastes == 5
+
+
+def test_poll_slows_down_after_the_fast_period():
+    watcher = ClipboardWatcher(FakeClipboard(), fast_interval=0.1, slow_interval=1.0, fast_period=20)
+    watcher.arm('')
+    assert watcher.interval() == 0.1
+    watcher.armed -= 30  # Half way through the back off
+    assert abs(watcher.interval() - 0.55) < 0.01
+    watcher.armed -= 30
+    assert watcher.interval() == 1.0
+
+
+def test_stdin_lines_pasted_together_are_all_returned(monkeypatch):
+    read, write = os.pipe()
+    with os.fdopen(read, 'r') as stdin:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        channel = LineChannel('stdin')
+        watcher = ClipboardWatcher(FakeClipboard(), channel, fast_interval=0.02)
+        watcher.arm('')
+        os.write(write, b'https://www.goodreads.com/book/show/1\nskip\nhttps://www.audible.com/pd/')
+        assert watcher.next() == 'https://www.goodreads.com/book/show/1'
+        assert channel.get(0.5) == 'skip'  # Already read with the first line, select() won't report it again
+        assert channel.get(0.05) is None  # The rest of the line hasn't been pasted yet
+        os.write(write, b'Book/B000000001\n')
+        assert channel.get(0.5) == 'https://www.audible.com/pd/Book/B000000001'
+        os.close(write)
+        assert not channel.get(0.05)  # End of input, nothing left to hand out
+
+
+def test_named_pipe_line_is_returned_before_the_next_poll(tmp_path):
+    pipe = tmp_path / 'urls'
+    channel = LineChannel(str(pipe))
+    watcher = ClipboardWatcher(FakeClipboard(), channel, fast_interval=5.0)
+    watcher.arm('')
+    with open(pipe, 'w', encoding='utf-8') as writer:
+        writer.write('https://www.goodreads.com/book/show/1\n')
+    start = time.monotonic()
+    assert watcher.next() == 'https://www.goodreads.com/book/show/1'
+    assert time.monotonic() - start < 1.0  # Not held back by the 5 second poll interval
@@ -0,0 +1,78 @@
+# --- copy_book() / copy_file() for --copy, copy-moves and --link ---
+import errno
+import logging
+import os
+
+import pytest
+
+import copier
+from copier import Progress, copy_book, copy_file, link_file
+
+log = logging.getLogger('test')
+
+
+class Recorder(Progress):
+    def __init__(self):
+        super().__init__(0)
+        self.added = []
+
+    def add(self, count):
+        self.added.append(count)
+        super().add(count)
+
+
+def test_progress_is_counted_while_a_large_file_copies(tmp_path, monkeypatch):
+    monkeypatch.setattr(copier, 'chunk_size', 1024 * 1024)
+    source = tmp_path / 'book.m4b'
+    source.write_bytes(os.urandom(3 * 1024 * 1024 + 10))
+    progress = Recorder()
+    assert copy_file(source, tmp_path / 'copy.m4b', progress) == source.stat().st_size
+    assert (tmp_path / 'copy.m4b').read_bytes() == source.read_bytes()
+    assert len(progress.added) == 4  # Every chunk, not once the whole file is done
+    assert progress.done == source.stat().st_size
+
+
+def test_copy_move_leaves_symlinked_files_alone(tmp_path):
+    outside = tmp_path / 'outside.txt'
+    outside.write_text('keep')
+    book = tmp_path / 'Book'
+    (book / 'CD1').mkdir(parents=True)
+    (book / 'CD1' / '01.mp3').write_bytes(b'audio')
+    (book / 'notes.txt').symlink_to(outside)
+    copy_book(book, tmp_path / 'Output', log, move=True, show_progress=False)
+    assert outside.read_text() == 'keep'
+    assert (tmp_path / 'Output' / 'notes.txt').is_symlink()
+    assert (tmp_path / 'Output' / 'CD1' / '01.mp3').read_bytes() == b'audio'
+    assert not book.exists()
+
+
+def refuse(code):
+    def link(source, destination):
+        raise OSError(code, os.strerror(code))
+    return link
+
+
+def test_link_copies_only_across_devices(tmp_path, monkeypatch):
+    source = tmp_path / '01.mp3'
+    source.write_bytes(b'audio')
+    monkeypatch.setattr(copier, 'reflink', refuse(errno.EXDEV))
+    assert link_file(source, tmp_path / 'out.mp3', 'reflink') == 'copy'
+    assert (tmp_path / 'out.mp3').read_bytes() == b'audio'
+
+
+def test_reflink_without_copy_on_write_fails_instead_of_copying(tmp_path, monkeypatch):
+    source = tmp_path / '01.mp3'
+    source.write_bytes(b'audio')
+    monkeypatch.setattr(copier, 'reflink', refuse(errno.EOPNOTSUPP))
+    with pytest.raises(OSError, match='--link-fallback copy'):
+        link_file(source, tmp_path / 'out.mp3', 'reflink')
+    assert not (tmp_path / 'out.mp3').exists()
+    assert link_file(source, tmp_path / 'out.mp3', 'reflink', fallback='copy') == 'copy'
+
+
+def test_auto_drops_to_a_hardlink_on_the_same_device(tmp_path, monkeypatch):
+    source = tmp_path / '01.mp3'
+    source.write_bytes(b'audio')
+    monkeypatch.setattr(copier, 'reflink', refuse(errno.EOPNOTSUPP))
+    assert link_file(source, tmp_path / 'out.mp3', 'auto') == 'hard'
+    assert os.path.samefile(source, tmp_path / 'out.mp3')
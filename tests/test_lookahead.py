@@ -0,0 +1,115 @@
+# --- SearchLookahead keeps the queue order while the next books are prepared out of order ---
+import logging
+import threading
+import time
+
+from browser import FakeBrowser
+from lookahead import SearchLookahead, search_page
+
+log = logging.getLogger('test')
+
+
+class SlowProber:
+    # --- Tags from the folder name, the first books take the longest so later ones finish first ---
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.probed = []
+        self.lock = threading.Lock()
+
+    def probe(self, folder):
+        time.sleep(self.delays.get(folder.name, 0))
+        with self.lock:
+            self.probed.append(folder.name)
+        return {'title': False, 'author': False, 'search_term': folder.name, 'url': None, 'fingerprint': None}
+
+
+def folders(tmp_path, count):
+    paths = [tmp_path / f"Book {number}" for number in range(count)]
+    for path in paths:
+        path.mkdir()
+    return paths
+
+
+def test_books_are_yielded_in_queue_order(tmp_path):
+    books = folders(tmp_path, 6)
+    prober = SlowProber({'Book 0': 0.2, 'Book 1': 0.1})
+    lookahead = SearchLookahead(prober, FakeBrowser(), log, window=3, workers=4)
+    yielded = [(folder.name, prepared.result()['page']) for folder, prepared in lookahead.books(books)]
+    lookahead.close()
+    assert yielded == [(f"Book {number}", search_page('both', f"Book {number}")) for number in range(6)]
+    assert prober.probed[0] != 'Book 0'  # Prepared out of order
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_first_book_is_yielded_before_the_stream_fills_the_window(tmp_path):
+    books = folders(tmp_path, 3)
+    more = threading.Event()
+
+    def stream():  # A slow --scan, the later books are only found once 'more' is set
+        yield books[0]
+        more.wait(5)
+        yield from books[1:]
+
+    lookahead = SearchLookahead(SlowProber({}), FakeBrowser(), log, window=2)
+    yielded = lookahead.books(stream())
+    folder, prepared = next(yielded)
+    assert folder.name == 'Book 0' and len(lookahead.events) == 1
+    more.set()
+    assert [folder.name for folder, prepared in yielded] == ['Book 1', 'Book 2']
+    lookahead.close()
+
+
+def test_window_books_are_submitted_while_the_first_is_worked_on(tmp_path):
+    books = folders(tmp_path, 6)
+    lookahead = SearchLookahead(SlowProber({}), FakeBrowser(), log, window=2)
+    stream = lookahead.books(iter(books))
+    folder, prepared = next(stream)
+    assert folder.name == 'Book 0'
+    assert wait_for(lambda: len(lookahead.events) == 3)  # The current book and the two after it
+    time.sleep(0.05)
+    assert len(lookahead.events) == 3  # No further than the window
+    next(stream)
+    assert wait_for(lambda: len(lookahead.events) == 4)
+    lookahead.close()
+
+
+def test_background_tabs_open_in_queue_order(tmp_path):
+    books = folders(tmp_path, 5)
+    browser = FakeBrowser()
+    prober = SlowProber({'Book 1': 0.2, 'Book 2': 0.1})  # Book 4's tab is ready first
+    lookahead = SearchLookahead(prober, browser, log, window=4, site='audible', tabs=True, workers=4)
+    prepared = [(folder.name, future.result()) for folder, future in lookahead.books(books)]
+    lookahead.close()
+    assert [result['tab'] for name, result in prepared] == [False, True, True, True, True]  # The current book is opened by the caller
+    assert browser.opened == [(search_page('audible', f"Book {number}"), True) for number in range(1, 5)]
+
+
+def test_no_tabs_without_lookahead_tabs(tmp_path):
+    browser = FakeBrowser()
+    lookahead = SearchLookahead(SlowProber({}), browser, log, window=2)
+    prepared = [future.result() for folder, future in lookahead.books(folders(tmp_path, 3))]
+    lookahead.close()
+    assert browser.opened == []
+    assert [result['matches'] for result in prepared] == [[], [], []]
+
+
+def test_close_lets_go_of_books_waiting_on_a_tab(tmp_path):
+    books = folders(tmp_path, 4)
+    browser = FakeBrowser()
+    prober = SlowProber({'Book 1': 0.5})
+    lookahead = SearchLookahead(prober, browser, log, window=3, tabs=True, workers=4)
+    stream = lookahead.books(books)
+    next(stream)
+    assert wait_for(lambda: len(lookahead.events) == 4)
+    start = time.monotonic()
+    lookahead.close()
+    assert time.monotonic() - start < 0.1
+    time.sleep(0.7)  # Book 1 finishes its probe and the books behind it don't hang on its event
+    assert len(browser.opened) == 3
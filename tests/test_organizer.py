@@ -0,0 +1,65 @@
+# --- Organizer API: the shared http client and cleanup after an error ---
+import sys
+
+import pytest
+
+import scrapers
+from browser import FakeBrowser
+from clipboard import ClipboardWatcher, FakeClipboard
+from organizer import Organizer
+from stub_server import StubServer, StubTransport
+
+
+@pytest.fixture
+def client():
+    scrapers.client = None
+    yield
+    scrapers.client = None
+
+
+def test_a_configured_client_is_kept(client, tmp_path):
+    transport = StubTransport(StubServer())
+    configured = scrapers.configure_client(rate=0, transport=transport)
+    first = Organizer(data_dir=tmp_path)
+    Organizer(data_dir=tmp_path, rate=2)
+    assert scrapers.client is configured and scrapers.client.transport is transport
+    first.close()
+
+
+def test_transport_option_replaces_the_client(client, tmp_path):
+    scrapers.configure_client(rate=0)
+    transport = StubTransport(StubServer())
+    organizer = Organizer(data_dir=tmp_path, transport=transport, timeout=5)
+    assert scrapers.client.transport is transport and scrapers.client.timeout == 5
+    organizer.close()
+
+
+def test_no_client_until_an_organizer_needs_one(client, tmp_path):
+    organizer = Organizer(data_dir=tmp_path, connections=2)
+    assert scrapers.client.session is None  # Opened by the first request
+    assert scrapers.client.max_connections == 2
+    organizer.close()
+
+
+class BrokenClipboard(FakeClipboard):
+    def paste(self):
+        raise RuntimeError('clipboard gone')
+
+
+def test_stdout_and_journal_are_restored_after_an_error(client, tmp_path):
+    book = tmp_path / 'Book'
+    book.mkdir()
+    stdout = sys.stdout
+    organizer = Organizer(data_dir=tmp_path, watcher=ClipboardWatcher(BrokenClipboard()), browser=FakeBrowser())
+    with pytest.raises(RuntimeError):
+        organizer.organize([book])
+    assert sys.stdout is stdout
+    assert organizer.journal.file.closed
+    organizer.close()
+
+
+def test_analyze_needs_an_opf_or_json_sidecar(client, tmp_path, caplog):
+    organizer = Organizer(data_dir=tmp_path, analyze=True, infotxt=True)
+    assert organizer.analyser is None
+    assert '--analyze does nothing' in caplog.text
+    organizer.close()
@@ -0,0 +1,76 @@
+# --- plan_tracks() / apply_plan() for [--flatten] and [--rename], names that collide must never overwrite a file ---
+import logging
+
+from optional import plan_tracks, apply_plan, describe_plan
+
+log = logging.getLogger('test')
+
+
+def make(book, *names):
+    for name in names:
+        path = book / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+
+
+def contents(book):
+    # --- {relative path: the name the file was created with} ---
+    return {path.relative_to(book).as_posix(): path.read_text() for path in book.rglob('*') if path.is_file()}
+
+
+def test_flatten_around_a_track_that_stays(tmp_path):
+    make(tmp_path, '01 - Book.mp3', 'CD1/a.mp3', 'CD2/a.mp3', 'cover.jpg')
+    moves, folders = plan_tracks(tmp_path, 'Book', log, flatten=True)
+    assert [(source.relative_to(tmp_path).as_posix(), destination.name) for source, destination in moves] == [
+        ('CD1/a.mp3', '01 - Book (2).mp3'),
+        ('CD2/a.mp3', '02 - Book.mp3'),
+    ]
+    assert folders == [tmp_path / 'CD1', tmp_path / 'CD2']
+
+    apply_plan((moves, folders), tmp_path, log)
+    assert contents(tmp_path) == {
+        '01 - Book.mp3': '01 - Book.mp3',
+        '01 - Book (2).mp3': 'CD1/a.mp3',
+        '02 - Book.mp3': 'CD2/a.mp3',
+        'cover.jpg': 'cover.jpg',
+    }
+
+
+def test_numbered_names_skip_every_taken_one(tmp_path):
+    make(tmp_path, '01 - Book.ogg', '01 - Book (2).ogg', 'Disc 1/track.ogg')
+    moves, folders = plan_tracks(tmp_path, 'Book', log, flatten=True)
+    assert [destination.name for source, destination in moves] == ['01 - Book (3).ogg']
+
+
+def test_rename_onto_a_name_still_in_use(tmp_path):
+    # - '02 - Book.mp3' becomes track 01 and 'b.mp3' takes its old name, through a temporary name -
+    make(tmp_path, '02 - Book.mp3', 'b.mp3')
+    moves, folders = plan_tracks(tmp_path, 'Book', log, rename=True)
+    assert [(source.name, destination.name) for source, destination in moves] == [
+        ('02 - Book.mp3', '01 - Book.mp3'),
+        ('b.mp3', '02 - Book.mp3'),
+    ]
+
+    apply_plan((moves, folders), tmp_path, log)
+    assert contents(tmp_path) == {'01 - Book.mp3': '02 - Book.mp3', '02 - Book.mp3': 'b.mp3'}
+
+
+def test_flatten_and_rename_in_one_plan(tmp_path):
+    make(tmp_path, 'intro.mp3', 'Part 1/CD1/01.mp3', 'Part 1/CD2/01.mp3', 'Part 1/notes.txt')
+    plan = plan_tracks(tmp_path, 'Book: A Title?', log, flatten=True, rename=True)
+    assert plan[1] == [tmp_path / 'Part 1/CD1', tmp_path / 'Part 1/CD2']
+    assert describe_plan(plan, tmp_path, '/library/Author/Book') == [
+        '  Part 1/CD1/01.mp3 --> /library/Author/Book/01 - Book A Title.mp3',
+        '  Part 1/CD2/01.mp3 --> /library/Author/Book/02 - Book A Title.mp3',
+        '  intro.mp3 --> /library/Author/Book/03 - Book A Title.mp3',
+        '  Remove: /library/Author/Book/Part 1/CD1',
+        '  Remove: /library/Author/Book/Part 1/CD2',
+    ]
+
+    apply_plan(plan, tmp_path, log)
+    assert contents(tmp_path) == {
+        '01 - Book A Title.mp3': 'Part 1/CD1/01.mp3',
+        '02 - Book A Title.mp3': 'Part 1/CD2/01.mp3',
+        '03 - Book A Title.mp3': 'intro.mp3',
+        'Part 1/notes.txt': 'Part 1/notes.txt',
+    }
@@ -0,0 +1,34 @@
+# --- PostProcessor results in submission order, with one progress line for the copies running in parallel ---
+import logging
+import sys
+import threading
+
+from copier import Progress
+from fetch import ThreadOutput
+from postprocess import PostProcessor
+
+log = logging.getLogger('test')
+
+
+def test_parallel_copies_share_one_progress_line(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(sys, 'stdout', ThreadOutput(sys.stdout))  # Installed by the Fetcher in a run
+    post = PostProcessor(log, workers=2)
+    release = threading.Event()
+
+    def copy(name, size):
+        progress = Progress(size)
+        post.progress.add(progress)
+        progress.add(size // 2)
+        release.wait(5)
+        post.progress.remove(progress)
+        print(f"{name} done")
+        return name
+
+    post.submit(copy, [tmp_path], tmp_path / 'A', 'A', 4 * 1048576)
+    post.submit(copy, [tmp_path], tmp_path / 'B', 'B', 2 * 1048576)
+    threading.Timer(0.7, release.set).start()
+    results = list(post.drain())
+    post.close()
+    assert results == [('A', 'A done\n'), ('B', 'B done\n')]
+    assert 'Copying 2 book(s): 3 / 6 MB' in capsys.readouterr().out
+    assert post.progress.line() == ''
@@ -0,0 +1,152 @@
+# --- Retries, back-off and the per-host circuit breaker, against the stub server with injected errors ---
+import logging
+import time
+
+import pytest
+
+import fetch
+import scrapers
+from fetch import Fetcher
+from scrapers import CircuitBreaker, HostUnavailable
+from stub_server import StubServer, StubTransport
+
+log = logging.getLogger('test')
+
+
+@pytest.fixture
+def server():
+    server = StubServer().start()
+    scrapers.configure_client(rate=0, transport=StubTransport(server))
+    yield server
+    server.shutdown()
+    server.server_close()
+    scrapers.client = None
+
+
+@pytest.fixture
+def create_fetcher():
+    # - Called in the test itself, pytest swaps sys.stdout back after the fixtures run -
+    fetchers = []
+
+    def create(wait=0):
+        # - The delay each retry asked for is kept in 'delays', it only waits up to 'wait' seconds -
+        fetcher = Fetcher(log, workers=2, retries=3)
+        fetcher.delays = []
+        later = fetcher.scheduler.later
+
+        def record(delay, submit):
+            fetcher.delays.append(delay)
+            return later(min(delay, wait), submit)
+
+        fetcher.scheduler.later = record
+        fetchers.append(fetcher)
+        return fetcher
+
+    yield create
+    for fetcher in fetchers:
+        fetcher.close()
+
+
+def book(number, tmp_path):
+    return tmp_path / f"Book {number}", f"https://www.goodreads.com/book/show/{number}", None
+
+
+def requests_for(server, number):
+    return [path for path in server.requests if path.startswith(f"/book/show/{number}")]
+
+
+def test_transient_errors_are_retried_at_the_back_of_the_queue(server, create_fetcher, tmp_path):
+    fetcher = create_fetcher()
+    server.inject(503, 2, '/book/show/1')
+    results = list(fetcher.results([book(1, tmp_path), book(2, tmp_path)]))
+    assert [folder.name for folder, metadata, output in results] == ['Book 2', 'Book 1']
+    assert all(metadata['failed'] is False for folder, metadata, output in results)
+    assert 'retrying Book 1' in results[1][2]
+    assert len(requests_for(server, 1)) == 3
+
+
+def test_backoff_doubles_until_the_cap(server, create_fetcher, tmp_path, monkeypatch):
+    fetcher = create_fetcher()
+    monkeypatch.setattr(fetch, 'retry_backoff', 2.0)
+    monkeypatch.setattr(fetch, 'retry_backoff_max', 5.0)
+    server.inject(500, 3, '/book/show/1')
+    [(folder, metadata, output)] = fetcher.results([book(1, tmp_path)])
+    assert metadata['failed'] is False
+    assert fetcher.delays == [2.0, 4.0, 5.0]
+
+
+def test_retry_after_header_sets_the_delay(server, create_fetcher, tmp_path):
+    fetcher = create_fetcher(wait=5)  # The host is paused for as long too
+    server.inject(429, 1, '/book/show/1', retry_after=1)
+    start = time.monotonic()
+    [(folder, metadata, output)] = fetcher.results([book(1, tmp_path)])
+    assert metadata['failed'] is False
+    assert fetcher.delays == [1.0]
+    assert time.monotonic() - start >= 1.0
+
+
+def test_book_fails_once_its_retries_are_spent(server, create_fetcher, tmp_path):
+    fetcher = create_fetcher()
+    server.inject(502, 100, '/book/show/1')
+    [(folder, metadata, output)] = fetcher.results([book(1, tmp_path)])
+    assert metadata['failed'] is True and metadata['skip'] is True
+    assert 'gave up after 4 attempts' in metadata['failed_exception']
+    assert len(requests_for(server, 1)) == 4  # The first try and 3 retries
+
+
+def test_dropped_connection_is_retried(server, create_fetcher, tmp_path):
+    fetcher = create_fetcher()
+    server.inject(0, 1, '/book/show/1')
+    [(folder, metadata, output)] = fetcher.results([book(1, tmp_path)])
+    assert metadata['failed'] is False
+    assert len(fetcher.delays) == 1
+
+
+def test_host_is_paused_after_repeated_errors(server):
+    server.inject(503, scrapers.breaker_threshold, '/book/show/')
+    client = scrapers.shared_client()
+    for number in range(scrapers.breaker_threshold):
+        assert client.get(f"https://www.goodreads.com/book/show/{number}").status_code == 503
+    with pytest.raises(HostUnavailable) as paused:
+        client.get('https://www.goodreads.com/book/show/9')
+    assert paused.value.delay > scrapers.breaker_cooldown - 1
+    assert len(server.requests) == scrapers.breaker_threshold  # Nothing sent while paused
+    assert client.get('https://api.audible.com/1.0/catalog/products/B000000001').status_code == 200  # Other hosts carry on
+
+
+def test_breaker_lets_one_probe_through_after_the_cooldown():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+    breaker.failure()
+    assert breaker.check() == 0
+    breaker.failure()
+    assert breaker.check() > 0
+    time.sleep(0.06)
+    assert breaker.check() == 0  # The probe
+    assert breaker.check() > 0  # Everything else waits for it
+    breaker.failure()
+    assert breaker.check() > 0.03  # A failed probe pauses the host again
+    time.sleep(0.06)
+    assert breaker.check() == 0
+    breaker.success()
+    assert breaker.check() == 0 and breaker.check() == 0
+
+
+def test_retry_after_pauses_the_host_without_counting_towards_the_breaker():
+    breaker = CircuitBreaker(threshold=5, cooldown=30)
+    breaker.failure(pause=0.05)
+    assert 0 < breaker.check() <= 0.05
+    time.sleep(0.06)
+    assert breaker.check() == 0
+
+
+def test_stalled_request_times_out_and_is_retried(server, create_fetcher, tmp_path):
+    scrapers.configure_client(rate=0, transport=StubTransport(server), timeout=(1.0, 0.3))
+    fetcher = create_fetcher()
+    server.inject(-1, 1, '/book/show/1')
+    start = time.monotonic()
+    results = list(fetcher.results([book(1, tmp_path), book(2, tmp_path)]))
+    assert time.monotonic() - start < 3.0
+    assert [folder.name for folder, metadata, output in results] == ['Book 2', 'Book 1']
+    assert all(metadata['failed'] is False for folder, metadata, output in results)
+    assert 'timed out' in results[1][2]
+    assert len(requests_for(server, 1)) == 2
@@ -0,0 +1,55 @@
+# --- FolderWatcher hands out settled folders once, failed ones again after a back-off ---
+import logging
+import time
+
+import watchfolder
+from watchfolder import FolderWatcher
+
+log = logging.getLogger('test')
+
+
+def watcher(tmp_path, *names):
+    incoming = tmp_path / 'incoming'
+    for name in names:
+        (incoming / name).mkdir(parents=True)
+    return FolderWatcher(incoming, tmp_path / 'watch.jsonl', log, quiet=0)
+
+
+def test_handled_folders_are_remembered_across_restarts(tmp_path):
+    folders = watcher(tmp_path, 'Book A', 'Book B')
+    batch = folders.ready()
+    assert [folder.name for folder in batch] == ['Book A', 'Book B']
+    assert folders.finished(batch) == {}
+    assert folders.ready() == []
+    folders.close()
+
+    restarted = watcher(tmp_path)
+    assert restarted.ready() == []
+    restarted.close()
+
+
+def test_failed_folders_are_handed_out_again_after_a_backoff(tmp_path, monkeypatch):
+    monkeypatch.setattr(watchfolder, 'retry_delay', 0.2)
+    folders = watcher(tmp_path, 'Book A', 'Book B')
+    batch = folders.ready()
+    retries = folders.finished(batch, failed=[batch[1]])
+    assert retries == {str(batch[1]): 0.2}
+    assert folders.ready() == []  # Not straight away
+    time.sleep(0.25)
+    assert folders.ready() == [batch[1]]
+    assert folders.finished([batch[1]], failed=[batch[1]]) == {str(batch[1]): 0.4}  # Doubled
+    folders.close()
+
+    restarted = watcher(tmp_path)
+    assert restarted.ready() == [batch[1]]  # Never recorded as handled
+    restarted.close()
+
+
+def test_dry_run_batches_are_not_recorded(tmp_path):
+    folders = watcher(tmp_path, 'Book A')
+    folders.finished(folders.ready(), remember=False)
+    assert folders.ready() == []
+    folders.close()
+    restarted = watcher(tmp_path)
+    assert [folder.name for folder in restarted.ready()] == ['Book A']
+    restarted.close()
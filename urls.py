@@ -0,0 +1,10 @@
+# --- Precompiled url patterns, shared by the clipboard queue, the fetch stage and the cache ---
+import re
+
+audible_url = re.compile(r"^http.+audible.+/pd/[\w-]+Audiobook/\w{10}")
+audible_asin = re.compile(r"^http.+audible.+/pd/[\w-]+Audiobook/(\w{10})")
+goodreads_url = re.compile(r"^http.+goodreads.+book/show/\d+")
+goodreads_id = re.compile(r"^http.+goodreads.+book/show/(\d+)")
+
+# --- Anything left on the clipboard by a previous book (urls, 'skip', a local candidate number) ---
+previous_contents = re.compile(r"http.+goodreads.+book/show/\d+|http.+audible.+/pd/[\w-]+Audiobook/\w+\??|skip|^[1-9]$")
@@ -0,0 +1,260 @@
+# --- [--watch] New book folders in a download directory, handed out once they have been quiet for a while ---
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from library import fingerprint
+
+# --- linux/inotify.h ---
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+top_mask = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM  # New and removed book folders
+book_mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF
+event_header = struct.Struct('iIII')  # wd, mask, cookie, len
+
+retry_delay = 300.0  # Seconds before a folder that failed is handed out again, doubled for each failure after
+retry_delay_max = 6 * 3600.0
+
+
+class Inotify:
+    # --- Minimal inotify through libc, None from create() where it isn't available ---
+
+    def __init__(self, libc):
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    @classmethod
+    def create(cls):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+            return cls(libc)
+        except (OSError, AttributeError):
+            return None
+
+    def add(self, path, mask):
+        # --- Watch descriptor, -1 if the path is gone or the watch limit was hit ---
+        return self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+
+    def remove(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        # --- [(wd, mask, name)] that arrived within timeout seconds ---
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FolderWatcher:
+    # ----- Book folders directly inside 'directory', each handed out once, state kept in an append-only file -----
+    # - Only folders still settling are watched, a big incoming directory costs one watch plus one per download -
+
+    def __init__(self, directory, state_path, log, quiet=60, ignore=()):
+        self.directory = Path(directory).resolve()
+        self.state_path = Path(state_path)
+        self.log = log
+        self.quiet = quiet
+        self.ignore = {str(Path(path)) for path in ignore}  # Output folders inside the directory
+        self.handled = set()  # Folders already handed out (full paths)
+        self.activity = {}  # Folder: time of the last change seen in it
+        self.failures = {}  # Folder: times it failed in a row, for the retry back-off
+        self.watches = {}  # wd: (book folder, watched path)
+        self.load()
+        self.state = self.state_path.open('a', encoding='utf-8')
+        self.inotify = Inotify.create()
+        self.top = self.inotify.add(self.directory, top_mask) if self.inotify is not None else -1
+        if self.top < 0:
+            log.info('inotify unavailable, polling the watch directory instead')
+            if self.inotify is not None:
+                self.inotify.close()
+            self.inotify = None
+        self.scan()
+
+    def load(self):
+        # --- Replay the state file, a folder re-created after being handled counts as new ---
+        if not self.state_path.exists():
+            return
+        with self.state_path.open('r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event['event'] == 'handled':
+                    self.handled.add(event['folder'])
+                elif event['event'] == 'new':
+                    self.handled.discard(event['folder'])
+
+    def record(self, folder, event):
+        self.state.write(json.dumps({'folder': str(folder), 'event': event}) + '\n')
+        self.state.flush()
+        os.fsync(self.state.fileno())
+
+    def scan(self):
+        # --- One scandir of the directory for folders that aren't handled or known yet ---
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_dir() and entry.path not in self.handled and entry.path not in self.activity and entry.path not in self.ignore:
+                    self.found(entry.path, last_change(entry.path))
+
+    def found(self, folder, changed):
+        self.log.debug(f"Watch: new folder {folder}")
+        self.activity[folder] = changed
+        if self.inotify is not None:
+            self.watch_tree(folder, folder)
+
+    def watch_tree(self, book, path):
+        for root, dirs, names in os.walk(path):
+            wd = self.inotify.add(root, book_mask)
+            if wd < 0:
+                self.log.info(f"Watch: couldn't watch {root}, errno {ctypes.get_errno()}")
+                continue
+            self.watches[wd] = (book, root)
+
+    def forget(self, folder):
+        # --- Stop watching a folder's tree ---
+        self.activity.pop(folder, None)
+        for wd, (book, path) in list(self.watches.items()):
+            if book == folder:
+                del self.watches[wd]
+                if self.inotify is not None:
+                    self.inotify.remove(wd)
+
+    def poll(self, timeout):
+        # ----- Wait up to timeout seconds for changes -----
+
+        if self.inotify is None:
+            time.sleep(timeout)
+            for folder in list(self.activity):
+                if not os.path.isdir(folder):
+                    self.forget(folder)
+                else:
+                    self.activity[folder] = max(self.activity[folder], last_change(folder))
+            self.scan()
+            return
+
+        now = time.time()
+        for wd, mask, name in self.inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:  # Events were lost, every settling folder starts its window over
+                self.log.info('Watch: inotify queue overflow, rescanning')
+                for folder in self.activity:
+                    self.activity[folder] = now
+                self.scan()
+            elif wd == self.top:
+                if not mask & IN_ISDIR:
+                    continue
+                folder = str(self.directory / name)
+                if folder in self.ignore:
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if folder in self.handled:
+                        self.handled.discard(folder)
+                        self.record(folder, 'new')
+                    if folder not in self.activity:
+                        self.found(folder, now if mask & IN_CREATE else last_change(folder))
+                else:
+                    self.forget(folder)
+            elif wd in self.watches:
+                book, path = self.watches[wd]
+                if mask & IN_IGNORED:
+                    del self.watches[wd]
+                    continue
+                if book in self.activity:
+                    self.activity[book] = now
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_tree(book, os.path.join(path, name))
+
+    def ready(self):
+        # --- Folders with no change for the quiet window, in name order ---
+        now = time.time()
+        return sorted(Path(folder) for folder, changed in self.activity.items() if now - changed >= self.quiet)
+
+    def batches(self):
+        # ----- Yield lists of settled folders forever, finished() must be called for each -----
+        while True:
+            ready = self.ready()
+            if ready:
+                yield ready
+                continue
+            if self.activity:
+                timeout = max(0.1, min(self.activity.values()) + self.quiet - time.time())
+            else:
+                timeout = self.quiet
+            self.poll(min(timeout, self.quiet))
+
+    def finished(self, folders, remember=True, failed=()):
+        # --- Handed out folders are never handed out again, unless re-created ---
+        # - remember=False ([--dry-run]) only skips them for this run, the state file is left alone -
+        # - 'failed' folders are handed out again after a back-off, returns {folder: seconds until then} -
+        failed = {str(Path(folder).resolve()) for folder in failed}
+        retries = {}
+        for folder in folders:
+            folder = str(folder)
+            if str(Path(folder).resolve()) in failed and os.path.isdir(folder):
+                retries[folder] = self.retry_later(folder)
+                continue
+            self.failures.pop(folder, None)
+            self.forget(folder)
+            self.handled.add(folder)
+            if remember:
+                self.record(folder, 'handled')
+        return retries
+
+    def retry_later(self, folder):
+        # --- Keep watching a failed folder, it's ready again once 'delay' seconds pass (or quiet after a change) ---
+        count = self.failures.get(folder, 0) + 1
+        self.failures[folder] = count
+        delay = min(retry_delay_max, retry_delay * 2 ** (count - 1))
+        self.activity[folder] = time.time() + delay - self.quiet
+        self.log.info(f"Watch: {folder} failed ({count} in a row), handed out again in {delay:.0f}s")
+        return delay
+
+    def close(self):
+        self.state.close()
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+def last_change(folder):
+    # --- Newest mtime in a folder tree (from its fingerprint), the folder's own if it's empty ---
+    try:
+        newest = int(fingerprint(folder).split(':')[2]) / 1e9
+        return max(newest, os.stat(folder).st_mtime)
+    except (OSError, ValueError, IndexError):
+        return time.time()